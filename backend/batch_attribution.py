@@ -0,0 +1,211 @@
+from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import io
+import logging
+import os
+import zipfile
+import numpy as np
+from embedding_cache import get_embedding_cache, content_hash, perceptual_hash
+from embedding_service import get_embedding_service
+from enrichment import summarize_artists, build_artist_infos, frontend_rows
+from generate_report import render_report
+from image_io import decode_image, CLIP_DECODE_SIZE
+from metadata_cache import get_artists_metadata
+from result_store import get_result_store
+from vector_utils import query_similar_vectors_many, get_clip_model
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Config ---
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "500"))
+# Images decoded, embedded and queried together
+BATCH_EMBED_SIZE = int(os.getenv("BATCH_EMBED_SIZE", "64"))
+BATCH_MAX_ARCHIVE_BYTES = int(os.getenv("BATCH_MAX_ARCHIVE_BYTES", str(500 * 1024 * 1024)))
+# Artists listed in the combined report
+BATCH_REPORT_ARTISTS = int(os.getenv("BATCH_REPORT_ARTISTS", "10"))
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff"}
+
+
+class BatchError(Exception):
+    pass
+
+
+def expand_archive(data, max_file_bytes):
+    """
+    (filename, bytes) for every image in a zip archive, checking sizes before extracting.
+    """
+    items = []
+    total = 0
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        for info in archive.infolist():
+            if info.is_dir() or os.path.splitext(info.filename)[1].lower() not in IMAGE_EXTENSIONS:
+                continue
+            if os.path.basename(info.filename).startswith("."):
+                continue
+            if info.file_size > max_file_bytes:
+                raise BatchError(f"{info.filename} exceeds the per-image size limit")
+            total += info.file_size
+            if total > BATCH_MAX_ARCHIVE_BYTES or len(items) >= BATCH_MAX_IMAGES:
+                raise BatchError(f"Archive exceeds {BATCH_MAX_IMAGES} images or {BATCH_MAX_ARCHIVE_BYTES} bytes")
+            items.append((info.filename, archive.read(info)))
+    return items
+
+
+def _prepare(image_bytes, top_k):
+    """
+    Cache lookup, then decode + preprocess on a miss. Runs on a worker thread.
+    """
+    cache = get_embedding_cache()
+    sha256 = content_hash(image_bytes)
+    prepared = {"sha256": sha256, "phash": None, "entry": cache.get_exact(sha256), "tensor": None}
+    if prepared["entry"] is None:
+        img = decode_image(image_bytes, min_size=CLIP_DECODE_SIZE)
+        prepared["phash"] = perceptual_hash(img)
+        prepared["entry"] = cache.get_near(sha256, prepared["phash"])
+    entry = prepared["entry"]
+    if entry is None:
+        _, preprocess = get_clip_model()
+        prepared["tensor"] = preprocess(img)
+    elif top_k not in entry["matches"]:
+        prepared["embedding"] = entry["embedding"]
+    return prepared
+
+
+def _prepare_chunk(chunk, top_k):
+    results = []
+    for filename, data in chunk:
+        try:
+            results.append(_prepare(data, top_k))
+        except Exception as e:
+            logger.warning(f"Invalid image {filename} in batch: {str(e)}")
+            results.append({"error": f"Invalid image format: {str(e)}"})
+    return results
+
+
+async def _match_chunk(chunk, top_k):
+    """
+    Top-k matches (or an error) per image: one CLIP batch and one multi-vector query.
+    """
+    prepared = await run_in_threadpool(_prepare_chunk, chunk, top_k)
+    matches = [None] * len(chunk)
+    need_embedding = [i for i, p in enumerate(prepared) if p.get("tensor") is not None]
+    need_query = [i for i, p in enumerate(prepared) if "error" not in p and
+                  (p.get("tensor") is not None or "embedding" in p)]
+
+    vectors = {}
+    if need_embedding:
+        embeddings = await get_embedding_service().embed_batch([prepared[i]["tensor"] for i in need_embedding])
+        vectors.update(zip(need_embedding, embeddings))
+    for i in need_query:
+        if i not in vectors:
+            vectors[i] = prepared[i]["embedding"]
+
+    if need_query:
+        results = await run_in_threadpool(
+            query_similar_vectors_many, np.stack([vectors[i] for i in need_query]), top_k
+        )
+        cache = get_embedding_cache()
+        for i, similar in zip(need_query, results):
+            matches[i] = similar
+            if prepared[i]["entry"] is not None:
+                cache.set_matches(prepared[i]["entry"], top_k, similar)
+            else:
+                cache.put(prepared[i]["sha256"], prepared[i]["phash"], vectors[i], {top_k: similar})
+
+    for i, p in enumerate(prepared):
+        if "error" in p:
+            matches[i] = p["error"]
+        elif matches[i] is None:
+            matches[i] = p["entry"]["matches"][top_k]
+    return matches
+
+
+async def stream_batch(items, top_k=5, report=False):
+    """
+    Score many (filename, bytes) images, yielding one dict per image as soon as it is
+    ready, then a summary (with the combined report's result id if report=True).
+
+    Metadata and bio lookups are shared across the whole batch: each artist is
+    fetched and summarised once however many images match it.
+    """
+    out = asyncio.Queue()
+    metadata_by_id = {}
+    bio_tasks = {}
+    best_scores = {}
+    done = object()
+
+    async def finish_image(index, filename, similar):
+        ids = [int(a) for a, _ in similar if int(a) in bio_tasks]
+        bios = dict(zip(ids, await asyncio.gather(*(bio_tasks[a] for a in ids))))
+        artist_infos, bio_summaries = build_artist_infos(similar, metadata_by_id, bios)
+        for info in artist_infos:
+            artist_id = int(info["artist_id"])
+            best_scores[artist_id] = max(best_scores.get(artist_id, float("-inf")), info["score"])
+        await out.put({"type": "result", "index": index, "filename": filename,
+                       "artists": frontend_rows(artist_infos, bio_summaries)})
+
+    async def produce():
+        image_tasks = []
+        try:
+            for start in range(0, len(items), BATCH_EMBED_SIZE):
+                chunk = items[start:start + BATCH_EMBED_SIZE]
+                matches = await _match_chunk(chunk, top_k)
+
+                new_ids = {int(a) for m in matches if isinstance(m, list) for a, _ in m} - set(metadata_by_id)
+                if new_ids:
+                    try:
+                        fetched = await run_in_threadpool(get_artists_metadata, sorted(new_ids))
+                    except Exception as e:
+                        logger.error(f"Metadata fetch failed: {str(e)}", exc_info=True)
+                        fetched = {}
+                    metadata_by_id.update(fetched)
+                    bio_tasks.update(summarize_artists(fetched))
+
+                for offset, (filename, _) in enumerate(chunk):
+                    index = start + offset
+                    if isinstance(matches[offset], str):
+                        await out.put({"type": "error", "index": index, "filename": filename,
+                                       "detail": matches[offset]})
+                    else:
+                        image_tasks.append(asyncio.ensure_future(finish_image(index, filename, matches[offset])))
+            await asyncio.gather(*image_tasks)
+        except Exception as e:
+            logger.error(f"Batch attribution failed: {str(e)}", exc_info=True)
+            for task in image_tasks:
+                task.cancel()
+            await out.put({"type": "error", "index": None, "filename": None, "detail": f"Batch error: {str(e)}"})
+        finally:
+            await out.put(done)
+
+    producer = asyncio.ensure_future(produce())
+    succeeded = failed = 0
+    try:
+        while True:
+            line = await out.get()
+            if line is done:
+                break
+            if line["type"] == "result":
+                succeeded += 1
+            else:
+                failed += 1
+            yield line
+    finally:
+        if not producer.done():
+            producer.cancel()
+
+    summary = {"type": "summary", "images": len(items), "succeeded": succeeded, "failed": failed}
+    if report and best_scores:
+        top = sorted(best_scores.items(), key=lambda kv: kv[1], reverse=True)[:BATCH_REPORT_ARTISTS]
+        bios = {a: bio_tasks[a].result() for a, _ in top if a in bio_tasks and bio_tasks[a].done()}
+        artist_infos, bio_summaries = build_artist_infos(top, metadata_by_id, bios)
+        try:
+            pdf = await render_report(artist_infos, bio_summaries)
+            summary["result_id"] = get_result_store().put(frontend_rows(artist_infos, bio_summaries), pdf)
+        except Exception as e:
+            logger.error(f"Combined batch report failed: {str(e)}", exc_info=True)
+            summary["report_error"] = str(e)
+    yield summary
@@ -0,0 +1,386 @@
+"""
+Benchmark the attribution and heatmap paths against local stand-ins.
+
+    python benchmark.py --sizes 256,512,1024 --concurrency 1,4,16 --requests 32 \
+        --output benchmark_results.json
+
+Pinecone, HANA and Claude are replaced with a NumPy vector index of random artist
+vectors, an SQLite table seeded from artists.csv and a stub summariser, each with
+an injected latency, so runs are reproducible and comparable between builds.
+The --*-error-rate flags make a fraction of their calls fail, to exercise the
+circuit breakers and fallbacks; breaker state is written to the output meta.
+CLIP, the heatmap and the PDF report run for real. Per-stage timings are read from
+the Server-Timing header (or the metrics spans, for direct generate_heatmap calls).
+
+Pass --url to benchmark a running server instead; it keeps its real backends.
+"""
+from contextlib import contextmanager
+from dotenv import load_dotenv
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Load CLIP before the first timed request and keep the metadata refresh thread
+# from reaching for HANA; both are read when the app modules are imported
+os.environ.setdefault("CLIP_WARMUP", "blocking")
+os.environ.setdefault("METADATA_PRELOAD", "off")
+
+# torch / CLIP (model_registry) and the app are imported inside the functions
+# that use them: the report pool's spawned workers re-import this module as
+# __mp_main__ and must not load the model
+import hana_utils
+import resilience
+from claude_utils import CLAUDE_TIMEOUT, FALLBACK_SUMMARY
+from metadata_cache import MetadataCache, METADATA_CACHE_SIZE, set_metadata_cache
+from metrics import start_request_timings
+from vector_store import LocalVectorStore, VectorStore, set_vector_store
+
+load_dotenv()
+
+TARGETS = ("upload", "compare", "heatmap")
+
+
+# --- Local stand-ins with injected latency and errors ---
+
+_rng = random.Random(0)
+
+
+def inject_error(rate, upstream):
+    if rate and _rng.random() < rate:
+        raise ConnectionError(f"Injected {upstream} failure")
+
+class DelayedVectorStore(VectorStore):
+    """
+    Wraps a vector store, sleeping `latency` seconds per round-trip like a remote
+    index and failing a fraction `error_rate` of them.
+    """
+
+    def __init__(self, store, latency, error_rate=0.0):
+        self.store = store
+        self.latency = latency
+        self.error_rate = error_rate
+
+    def query(self, vector, top_k=5, include_metadata=False):
+        time.sleep(self.latency)
+        inject_error(self.error_rate, "vector store")
+        return self.store.query(vector, top_k, include_metadata)
+
+    def query_many(self, vectors, top_k=5, include_metadata=False):
+        time.sleep(self.latency)
+        inject_error(self.error_rate, "vector store")
+        return self.store.query_many(vectors, top_k, include_metadata)
+
+    def count(self):
+        return self.store.count()
+
+
+class DelayedPool:
+    """
+    Wraps a ConnectionPool, sleeping `latency` seconds per query like a remote
+    database and failing a fraction `error_rate` of them.
+    """
+
+    def __init__(self, pool, latency, error_rate=0.0):
+        self.pool = pool
+        self.latency = latency
+        self.error_rate = error_rate
+
+    @contextmanager
+    def connection(self):
+        time.sleep(self.latency)
+        inject_error(self.error_rate, "metadata")
+        with self.pool.connection() as conn:
+            yield conn
+
+    def close(self):
+        self.pool.close()
+
+
+def stub_summarizer(latency, error_rate=0.0):
+    def fetch(url):
+        time.sleep(latency)
+        inject_error(error_rate, "summarizer")
+        return f"Benchmark summary for {url}."
+
+    def summarize(url):
+        # Guarded like claude_utils.summarize_wikipedia_url, minus the summary cache
+        return resilience.call("summarizer", fetch, url, timeout=CLAUDE_TIMEOUT, fallback=lambda: FALLBACK_SUMMARY)
+    return summarize
+
+
+def install_fakes(csv_path, index_dir, vector_ms, metadata_ms, summary_ms, metadata_cache=True, seed=0,
+                  vector_errors=0.0, metadata_errors=0.0, summary_errors=0.0):
+    """
+    Point the vector store, metadata database and summariser at local stand-ins.
+    """
+    import enrichment
+    import model_registry
+
+    _rng.seed(seed)
+    artists = hana_utils.load_artists_csv(csv_path)
+    model, _ = model_registry.get_model()
+    rng = np.random.default_rng(seed)
+    store = LocalVectorStore(path=index_dir, mode="exact")
+    store.upsert(list(artists), rng.standard_normal((len(artists), model.visual.output_dim)))
+    store.flush()
+    set_vector_store(DelayedVectorStore(store, vector_ms / 1000, vector_errors))
+
+    pool = hana_utils.create_sqlite_pool(csv_path, database="file:benchmark_artists?mode=memory&cache=shared")
+    hana_utils.set_pool(DelayedPool(pool, metadata_ms / 1000, metadata_errors))
+    # max_size=0 sends every lookup to the (delayed) database
+    set_metadata_cache(MetadataCache(max_size=METADATA_CACHE_SIZE if metadata_cache else 0))
+
+    enrichment.summarize_wikipedia_url = stub_summarizer(summary_ms / 1000, summary_errors)
+
+
+# --- Workload ---
+
+def make_image(size, seed, quality=90):
+    """
+    JPEG bytes of a size x size image: smooth colour fields plus grain. Every seed
+    gives a perceptually different image, so uploads miss the embedding cache.
+    """
+    rng = np.random.default_rng(seed)
+    base = Image.fromarray(rng.integers(0, 256, (8, 8, 3), dtype=np.uint8)).resize((size, size), Image.BICUBIC)
+    pixels = np.asarray(base, dtype=np.int16) + rng.integers(-12, 13, (size, size, 3))
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def parse_server_timing(header):
+    """
+    [(name, ms)] from a Server-Timing header value.
+    """
+    timings = []
+    for entry in (header or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur" and name:
+                timings.append((name, float(value)))
+    return timings
+
+
+def latency_stats(values_ms):
+    values = np.asarray(values_ms, dtype=np.float64)
+    if not len(values):
+        return {}
+    return {
+        "count": int(len(values)),
+        "mean_ms": round(float(values.mean()), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p90_ms": round(float(np.percentile(values, 90)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "max_ms": round(float(values.max()), 2),
+    }
+
+
+async def run_scenario(send, requests, concurrency, warmup=0):
+    """
+    Call send(i) `requests` times with at most `concurrency` calls in flight.
+    send returns [(stage, ms)] for the call.
+    """
+    for i in range(warmup):
+        await send(-1 - i)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    stages = {}
+    errors = []
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                timings = await send(i)
+            except Exception as e:
+                errors.append(str(e))
+                return
+            latencies.append((time.perf_counter() - start) * 1000)
+            for name, ms in timings:
+                stages.setdefault(name, []).append(ms)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    wall = time.perf_counter() - start
+    return {
+        "requests": requests,
+        "errors": len(errors),
+        "error_samples": errors[:3],
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 3) if wall else 0.0,
+        "latency": latency_stats(latencies),
+        "stages": {name: latency_stats(values) for name, values in sorted(stages.items())},
+    }
+
+
+def http_sender(client, target, size, seed):
+    async def send(i):
+        if target == "upload":
+            files = {"image": ("benchmark.jpg", make_image(size, seed + i), "image/jpeg")}
+            response = await client.post("/upload_and_download", files=files)
+        else:
+            files = {
+                "original_image": ("original.jpg", make_image(size, seed + i), "image/jpeg"),
+                "ai_image": ("ai.jpg", make_image(size, seed + i + 1_000_003), "image/jpeg"),
+            }
+            response = await client.post("/compare_artworks", files=files)
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+        return parse_server_timing(response.headers.get("server-timing"))
+    return send
+
+
+def heatmap_sender(executor, size, seed):
+    import heatmap_generator
+
+    def call(i):
+        timings = start_request_timings()
+        start = time.perf_counter()
+        heatmap_generator.generate_heatmap(make_image(size, seed + i), make_image(size, seed + i + 1_000_003), io.BytesIO())
+        return [(name, elapsed * 1000) for name, elapsed in timings] + [("total", (time.perf_counter() - start) * 1000)]
+
+    async def send(i):
+        return await asyncio.get_running_loop().run_in_executor(executor, call, i)
+    return send
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmarks(args):
+    import httpx
+
+    in_process = args.url is None
+    if in_process:
+        install_fakes(args.artists_csv, args.index_dir, args.vector_latency_ms, args.metadata_latency_ms,
+                      args.summary_latency_ms, metadata_cache=not args.cold_metadata, seed=args.seed,
+                      vector_errors=args.vector_error_rate, metadata_errors=args.metadata_error_rate,
+                      summary_errors=args.summary_error_rate)
+        # main mounts ../frontend relative to the working directory
+        os.chdir(BASE_DIR)
+        from main import app
+        await app.router.startup()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark", timeout=None)
+    else:
+        app = None
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+
+    results = []
+    try:
+        for target in args.targets:
+            if target == "heatmap" and not in_process:
+                continue
+            for size in args.sizes:
+                for concurrency in args.concurrency:
+                    seed = args.seed + 10_000 * len(results)
+                    if target == "heatmap":
+                        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                            result = await run_scenario(heatmap_sender(executor, size, seed),
+                                                        args.requests, concurrency, args.warmup)
+                    else:
+                        result = await run_scenario(http_sender(client, target, size, seed),
+                                                    args.requests, concurrency, args.warmup)
+                    result = {"target": target, "image_size": size, "concurrency": concurrency, **result}
+                    results.append(result)
+                    latency = result["latency"]
+                    print(f"{target:8} {size:5}px  c={concurrency:<3} {result['throughput_rps']:8.2f} req/s  "
+                          f"p50 {latency.get('p50_ms', 0):8.1f} ms  p99 {latency.get('p99_ms', 0):8.1f} ms  "
+                          f"errors {result['errors']}")
+    finally:
+        await client.aclose()
+        if app is not None:
+            await app.router.shutdown()
+    return results
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def main():
+    import model_registry
+
+    parser = argparse.ArgumentParser(description="Benchmark /upload_and_download, /compare_artworks and generate_heatmap")
+    parser.add_argument("--targets", type=lambda v: [t for t in v.split(",") if t], default=list(TARGETS),
+                        help=f"Comma-separated subset of {','.join(TARGETS)}")
+    parser.add_argument("--sizes", type=_int_list, default=[256, 512, 1024], help="Square image sizes in pixels")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=32, help="Timed requests per scenario")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed requests before each scenario")
+    parser.add_argument("--vector-latency-ms", type=float, default=20.0)
+    parser.add_argument("--metadata-latency-ms", type=float, default=5.0)
+    parser.add_argument("--summary-latency-ms", type=float, default=800.0)
+    parser.add_argument("--vector-error-rate", type=float, default=0.0, help="Fraction of vector queries that fail")
+    parser.add_argument("--metadata-error-rate", type=float, default=0.0, help="Fraction of metadata queries that fail")
+    parser.add_argument("--summary-error-rate", type=float, default=0.0, help="Fraction of summaries that fail")
+    parser.add_argument("--cold-metadata", action="store_true", help="Disable the metadata cache")
+    parser.add_argument("--artists-csv", default=os.path.join(BASE_DIR, "artists.csv"))
+    parser.add_argument("--index-dir", default=None, help="Where to build the benchmark vector index (default: temp dir)")
+    parser.add_argument("--url", default=None, help="Benchmark a running server instead of the in-process app")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    unknown = set(args.targets) - set(TARGETS)
+    if unknown:
+        parser.error(f"Unknown targets: {', '.join(sorted(unknown))}")
+    output = os.path.abspath(args.output)
+
+    with tempfile.TemporaryDirectory(prefix="trumuse-bench-") as tmp:
+        args.index_dir = args.index_dir or os.path.join(tmp, "vector_index")
+        started = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        results = asyncio.run(run_benchmarks(args))
+
+    report = {
+        "meta": {
+            "started_at": started,
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "device": model_registry.default_device(),
+            "clip_model": model_registry.DEFAULT_MODEL,
+            "target": args.url or "in-process",
+            "argv": sys.argv[1:],
+            "injected_latency_ms": None if args.url else {
+                "vector_store": args.vector_latency_ms,
+                "metadata": args.metadata_latency_ms,
+                "summary": args.summary_latency_ms,
+            },
+            "injected_error_rate": None if args.url else {
+                "vector_store": args.vector_error_rate,
+                "metadata": args.metadata_error_rate,
+                "summary": args.summary_error_rate,
+            },
+            "circuit_breakers": None if args.url else resilience.stats(),
+        },
+        "results": results,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} scenarios to {output}")
+
+
+if __name__ == "__main__":
+    main()
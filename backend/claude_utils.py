@@ -1,10 +1,20 @@
 import requests
 import os
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from summary_cache import get_summary_cache, summary_key
+import resilience
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 CLAUDE_API_KEY = os.getenv("CLAUDE_API_KEY")
+CLAUDE_MODEL = os.getenv("CLAUDE_MODEL", "claude-sonnet-4-20250514")
+# Seconds one Messages API call may take (also capped by the request budget)
+CLAUDE_TIMEOUT = float(os.getenv("CLAUDE_TIMEOUT", "15"))
 
 headers = {
     "x-api-key": CLAUDE_API_KEY,
@@ -12,37 +22,85 @@ headers = {
     "content-type": "application/json"
 }
 
-def summarize_wikipedia_url(url):
-    prompt = f"""
+# Reuse connections to the Messages API across calls
+session = requests.Session()
+session.headers.update(headers)
+
+FALLBACK_SUMMARY = "The artist is recognized for significant artistic contributions and a distinctive style."
+
+def build_prompt(url):
+    return f"""
     You are an expert art historian. Provide a 100-150 word summary of the artist's key contributions, style, and significance based on the Wikipedia page at {url}. 
     You must not include any statements about inability to access the URL, internet, or external resources. If the URL is inaccessible, use your existing knowledge to create a factual summary. Avoid phrases such as 'I'm unable to access,' 'cannot retrieve,' 'cannot browse,' or any similar disclaimers. Focus solely on the artist's contributions, style, and significance.
     """
 
+def fetch_summary(url):
+    """
+    Ask Claude for a summary of the artist at url. Raises on API errors.
+    """
     payload = {
-        "model": "claude-sonnet-4-20250514",
+        "model": CLAUDE_MODEL,
         "max_tokens": 500,
         "temperature": 0.5,
         "messages": [
-            {"role": "user", "content": prompt}
+            {"role": "user", "content": build_prompt(url)}
         ]
     }
 
+    response = session.post("https://api.anthropic.com/v1/messages", json=payload, timeout=CLAUDE_TIMEOUT)
+    response.raise_for_status()
+    summary = response.json()["content"][0]["text"]
+    # Remove unwanted disclaimer phrases
+    unwanted_phrases = [
+        "I'm unable to access external URLs",
+        "cannot retrieve the specific Wikipedia page",
+        "cannot browse the internet",
+        "I'm unable to access",
+        "cannot retrieve",
+        "cannot browse"
+    ]
+    for phrase in unwanted_phrases:
+        summary = summary.replace(phrase, "").strip()
+    return summary if summary else "The artist is known for notable contributions to art."
+
+def summarize_wikipedia_url(url):
+    key = summary_key(url, build_prompt(url), CLAUDE_MODEL)
+    # Not hedged: a duplicate generation costs tokens
+    fetch = lambda: resilience.call("summarizer", fetch_summary, url, timeout=CLAUDE_TIMEOUT)
     try:
-        response = requests.post("https://api.anthropic.com/v1/messages", headers=headers, json=payload)
-        response.raise_for_status()
-        summary = response.json()["content"][0]["text"]
-        # Remove unwanted disclaimer phrases
-        unwanted_phrases = [
-            "I'm unable to access external URLs",
-            "cannot retrieve the specific Wikipedia page",
-            "cannot browse the internet",
-            "I'm unable to access",
-            "cannot retrieve",
-            "cannot browse"
-        ]
-        for phrase in unwanted_phrases:
-            summary = summary.replace(phrase, "").strip()
-        return summary if summary else "The artist is known for notable contributions to art."
-    except (requests.RequestException, KeyError, IndexError):
+        try:
+            cache = get_summary_cache()
+        except sqlite3.Error as e:
+            # The cache logs its own read/write errors; this is opening it
+            logger.warning(f"Summary cache unavailable, fetching uncached: {str(e)}")
+            return fetch()
+        return cache.get_or_compute(key, fetch, url=url, model=CLAUDE_MODEL)
+    except (requests.RequestException, KeyError, IndexError, resilience.CircuitOpen, resilience.DeadlineExceeded):
         # Fallback summary without disclaimer
-        return "The artist is recognized for significant artistic contributions and a distinctive style."
\ No newline at end of file
+        return FALLBACK_SUMMARY
+
+def prewarm_summaries(urls, workers=4):
+    """
+    Fill the summary cache for every url. Returns the number of urls summarized.
+    """
+    urls = [u for u in dict.fromkeys(urls) if u]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        summaries = list(executor.map(summarize_wikipedia_url, urls))
+    failed = sum(1 for s in summaries if s == FALLBACK_SUMMARY)
+    if failed:
+        logger.warning("%d of %d summaries fell back and were not cached", failed, len(urls))
+    try:
+        get_summary_cache().purge_expired()
+    except sqlite3.Error as e:
+        logger.warning(f"Failed to purge expired summaries: {str(e)}")
+    return len(urls) - failed
+
+if __name__ == "__main__":
+    # Offline pre-warm: python claude_utils.py [artists.csv] [workers]
+    import sys
+    from hana_utils import load_artists_csv
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "artists.csv")
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    artists = load_artists_csv(csv_path)
+    done = prewarm_summaries([a["wikipedia"] for a in artists.values()], workers=workers)
+    print(f"Cached {done} of {len(artists)} artist summaries in {get_summary_cache().path}")
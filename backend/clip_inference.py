@@ -0,0 +1,233 @@
+"""
+CPU inference settings for the CLIP image encoder, and an accuracy check for them.
+
+    python clip_inference.py /data/reference_paintings --top-k 5
+
+The check embeds a reference image set with the plain fp32 encoder and with the
+configured mode (CLIP_QUANTIZE / CLIP_AUTOCAST / CLIP_COMPILE), then reports the
+cosine drift between the two embeddings of each image and how often their top-k
+matches in the vector index agree. It exits non-zero when either is out of bounds.
+"""
+from dotenv import load_dotenv
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import numpy as np
+import torch
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Config ---
+# "int8": dynamic int8 quantisation of the encoder's Linear layers
+CLIP_QUANTIZE = os.getenv("CLIP_QUANTIZE", "off")
+# "bf16": run the encoder under bfloat16 autocast (needs a CPU with bf16 support to pay off)
+CLIP_AUTOCAST = os.getenv("CLIP_AUTOCAST", "off")
+# "compile" (torch.compile) or "script" (TorchScript trace)
+CLIP_COMPILE = os.getenv("CLIP_COMPILE", "off")
+# Threads per worker process; 0 splits the cores evenly between WEB_CONCURRENCY workers
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", "0"))
+TORCH_INTEROP_THREADS = int(os.getenv("TORCH_INTEROP_THREADS", "1"))
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff"}
+
+_threads_configured = False
+_threads_lock = threading.Lock()
+
+
+def _reset_threads_after_fork():
+    # A pre-forked worker sizes its own pools (see serve.py)
+    global _threads_configured, _threads_lock
+    _threads_configured = False
+    _threads_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_threads_after_fork)
+
+
+def configure_threads(num_threads=TORCH_NUM_THREADS, interop_threads=TORCH_INTEROP_THREADS,
+                      workers=WEB_CONCURRENCY):
+    """
+    Size PyTorch's intra- and inter-op pools for this worker so that several workers
+    on one machine don't oversubscribe the cores. Runs once per process.
+    """
+    global _threads_configured
+    with _threads_lock:
+        if _threads_configured:
+            return
+        _threads_configured = True
+        if num_threads <= 0:
+            num_threads = max(1, (os.cpu_count() or 1) // max(1, workers))
+        torch.set_num_threads(num_threads)
+        if interop_threads > 0:
+            try:
+                torch.set_num_interop_threads(interop_threads)
+            except RuntimeError as e:
+                # Only allowed before the first inter-op parallel work in the process
+                logger.warning(f"Could not set inter-op threads: {str(e)}")
+        logger.info("Torch threads: intra-op %d, inter-op %d", torch.get_num_threads(), torch.get_num_interop_threads())
+
+
+def _autocast(encode_image, dtype):
+    def encode(image):
+        with torch.autocast("cpu", dtype=dtype):
+            return encode_image(image).float()
+    return encode
+
+
+def optimize_for_cpu(model, quantize=CLIP_QUANTIZE, autocast=CLIP_AUTOCAST, compile_mode=CLIP_COMPILE):
+    """
+    Apply the configured CPU inference mode to a loaded CLIP model, in place.
+
+    Only the image encoder is touched. model.eager_visual keeps the (possibly
+    quantised) encoder as plain modules for code that calls its layers directly,
+    such as the heatmap's patch-token path, which a compiled or traced encoder
+    would not run correctly at other input sizes.
+    """
+    if quantize == "int8":
+        torch.ao.quantization.quantize_dynamic(model.visual, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    elif quantize != "off":
+        raise ValueError(f"Unknown CLIP_QUANTIZE: {quantize}")
+
+    model.eager_visual = model.visual
+    example = torch.randn(1, 3, model.visual.input_resolution, model.visual.input_resolution)
+    if compile_mode == "compile":
+        model.visual = torch.compile(model.visual, dynamic=True)
+        # Compile now rather than on the first request
+        with torch.no_grad():
+            model.visual(example)
+    elif compile_mode == "script":
+        with torch.no_grad():
+            model.visual = torch.jit.trace(model.visual, example)
+    elif compile_mode != "off":
+        raise ValueError(f"Unknown CLIP_COMPILE: {compile_mode}")
+
+    if autocast == "bf16":
+        if quantize == "int8":
+            # Dynamically quantised Linear layers only take fp32 inputs
+            logger.warning("CLIP_AUTOCAST=bf16 is ignored with CLIP_QUANTIZE=int8")
+        else:
+            model.encode_image = _autocast(model.encode_image, torch.bfloat16)
+    elif autocast != "off":
+        raise ValueError(f"Unknown CLIP_AUTOCAST: {autocast}")
+    return model
+
+
+def describe(quantize=CLIP_QUANTIZE, autocast=CLIP_AUTOCAST, compile_mode=CLIP_COMPILE):
+    return {
+        "quantize": quantize,
+        "autocast": autocast,
+        "compile": compile_mode,
+        "threads": torch.get_num_threads(),
+        "interop_threads": torch.get_num_interop_threads(),
+    }
+
+
+# --- Accuracy check ---
+
+def _embed_all(model, tensors, batch_size):
+    embeddings = []
+    start = time.perf_counter()
+    with torch.no_grad():
+        for i in range(0, len(tensors), batch_size):
+            features = model.encode_image(torch.stack(tensors[i:i + batch_size])).float().numpy()
+            embeddings.append(features / np.linalg.norm(features, axis=1, keepdims=True))
+    return np.concatenate(embeddings), time.perf_counter() - start
+
+
+def _top_k_ids(embeddings, top_k, store=None):
+    if store is not None:
+        return [[m.id for m in matches] for matches in store.query_many(embeddings, top_k=top_k)]
+    # No index: rank the reference images against each other
+    scores = embeddings @ embeddings.T
+    return [list(np.argsort(-row)[:top_k]) for row in scores]
+
+
+def check_accuracy(image_paths, top_k=5, batch_size=32, store=None, name=None,
+                   quantize=CLIP_QUANTIZE, autocast=CLIP_AUTOCAST, compile_mode=CLIP_COMPILE):
+    """
+    Compare the configured inference mode against fp32 on a set of images.
+    Returns cosine drift (1 - cosine similarity, per image), top-k overlap and
+    top-1 agreement of the matches, and the throughput of both encoders.
+    """
+    import clip
+    import model_registry
+    from image_io import decode_image, CLIP_DECODE_SIZE
+
+    name = name or model_registry.DEFAULT_MODEL
+    reference, preprocess = clip.load(name, device="cpu")
+    reference.eval()
+    candidate, _ = clip.load(name, device="cpu")
+    candidate.eval()
+    optimize_for_cpu(candidate, quantize, autocast, compile_mode)
+
+    tensors = [preprocess(decode_image(path, min_size=CLIP_DECODE_SIZE)) for path in image_paths]
+    # The first call pays for compilation / tracing warm-up; keep it out of the timing
+    _embed_all(candidate, tensors[:1], 1)
+    ref_embeddings, ref_seconds = _embed_all(reference, tensors, batch_size)
+    new_embeddings, new_seconds = _embed_all(candidate, tensors, batch_size)
+
+    drift = 1.0 - (ref_embeddings * new_embeddings).sum(axis=1)
+    ref_ids = _top_k_ids(ref_embeddings, top_k, store)
+    new_ids = _top_k_ids(new_embeddings, top_k, store)
+    overlap = [len(set(a) & set(b)) / max(1, len(a)) for a, b in zip(ref_ids, new_ids)]
+    top1 = [bool(a) and bool(b) and a[0] == b[0] for a, b in zip(ref_ids, new_ids)]
+
+    return {
+        "mode": describe(quantize, autocast, compile_mode),
+        "images": len(tensors),
+        "top_k": top_k,
+        "cosine_drift_mean": float(drift.mean()),
+        "cosine_drift_max": float(drift.max()),
+        "top_k_overlap": float(np.mean(overlap)),
+        "top1_agreement": float(np.mean(top1)),
+        "fp32_images_per_sec": round(len(tensors) / ref_seconds, 2),
+        "optimized_images_per_sec": round(len(tensors) / new_seconds, 2),
+    }
+
+
+def _image_paths(root):
+    paths = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS:
+                paths.append(os.path.join(dirpath, filename))
+    return sorted(paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the configured CLIP CPU inference mode against fp32")
+    parser.add_argument("images", help="Directory of reference images")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--limit", type=int, default=200, help="Use at most this many images")
+    parser.add_argument("--no-index", action="store_true",
+                        help="Rank the reference images against each other instead of querying the vector index")
+    parser.add_argument("--max-drift", type=float, default=0.01, help="Fail above this mean cosine drift")
+    parser.add_argument("--min-overlap", type=float, default=0.9, help="Fail below this mean top-k overlap")
+    args = parser.parse_args()
+
+    paths = _image_paths(args.images)[:args.limit]
+    if not paths:
+        parser.error(f"No images found under {args.images}")
+    store = None
+    if not args.no_index:
+        from vector_store import get_vector_store
+        store = get_vector_store()
+
+    configure_threads()
+    report = check_accuracy(paths, top_k=args.top_k, batch_size=args.batch_size, store=store)
+    report["passed"] = report["cosine_drift_mean"] <= args.max_drift and report["top_k_overlap"] >= args.min_overlap
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
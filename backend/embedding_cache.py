@@ -0,0 +1,216 @@
+from collections import OrderedDict
+from dotenv import load_dotenv
+from PIL import Image
+import hashlib
+import logging
+import os
+import threading
+import time
+import numpy as np
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Config ---
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "4096"))
+EMBED_CACHE_TTL = float(os.getenv("EMBED_CACHE_TTL", "86400"))
+# "dhash" or "phash"
+EMBED_CACHE_HASH = os.getenv("EMBED_CACHE_HASH", "phash")
+# Max differing bits (out of 64) for two images to count as the same picture; 0 disables
+EMBED_CACHE_HAMMING = int(os.getenv("EMBED_CACHE_HAMMING", "4"))
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def dhash(image, size=8):
+    """
+    64-bit difference hash: brightness gradient sign between horizontal neighbours.
+    """
+    pixels = np.asarray(image.convert("L").resize((size + 1, size), Image.Resampling.LANCZOS), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    matrix[0] *= 1 / np.sqrt(2)
+    return matrix * np.sqrt(2 / n)
+
+
+_DCT_32 = _dct_matrix(32)
+
+
+def phash(image):
+    """
+    64-bit perceptual hash: low-frequency 8x8 DCT coefficients of a 32x32 greyscale
+    thumbnail, thresholded at their median.
+    """
+    pixels = np.asarray(image.convert("L").resize((32, 32), Image.Resampling.LANCZOS), dtype=np.float64)
+    coefficients = (_DCT_32 @ pixels @ _DCT_32.T)[:8, :8].ravel()
+    bits = coefficients > np.median(coefficients[1:])
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def perceptual_hash(image, kind=EMBED_CACHE_HASH):
+    return dhash(image) if kind == "dhash" else phash(image)
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def _bands(threshold, bits=64):
+    """
+    (shift, mask) of threshold + 1 bit ranges covering the hash. Two hashes within
+    threshold bits of each other agree exactly on at least one range (pigeonhole).
+    """
+    count = min(threshold + 1, bits)
+    edges = [round(i * bits / count) for i in range(count + 1)]
+    return [(lo, (1 << (hi - lo)) - 1) for lo, hi in zip(edges, edges[1:])]
+
+
+class EmbeddingCache:
+    """
+    Cache of CLIP embeddings and top-k matches for uploaded images.
+
+    Exact repeats are found by the SHA-256 of the upload bytes. Re-encoded or resized
+    copies are found by perceptual hash within hamming_threshold bits, looking only
+    at entries that share one band of the hash. Bounded LRU with a TTL.
+    """
+
+    def __init__(self, max_items=EMBED_CACHE_SIZE, ttl=EMBED_CACHE_TTL, hamming_threshold=EMBED_CACHE_HAMMING):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.hamming_threshold = hamming_threshold
+        # sha256 -> entry; several hashes may share one entry
+        self._entries = OrderedDict()
+        # One {band value: set of sha256} per band of the perceptual hash
+        self._bands = _bands(hamming_threshold) if hamming_threshold > 0 else []
+        self._index = [{} for _ in self._bands]
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _live(self, entry, now):
+        return entry["expires_at"] > now
+
+    # The helpers below keep _entries and _index in step; callers hold the lock
+
+    def _band_keys(self, image_hash):
+        return [(image_hash >> shift) & mask for shift, mask in self._bands]
+
+    def _add(self, sha256, entry):
+        self._remove(sha256)
+        self._entries[sha256] = entry
+        for index, key in zip(self._index, self._band_keys(entry["phash"])):
+            index.setdefault(key, set()).add(sha256)
+
+    def _remove(self, sha256):
+        entry = self._entries.pop(sha256, None)
+        if entry is None:
+            return
+        for index, key in zip(self._index, self._band_keys(entry["phash"])):
+            shas = index.get(key)
+            if shas is not None:
+                shas.discard(sha256)
+                if not shas:
+                    del index[key]
+
+    def get_exact(self, sha256):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(sha256)
+            if entry is not None and self._live(entry, now):
+                self._entries.move_to_end(sha256)
+                self.exact_hits += 1
+                return entry
+            if entry is not None:
+                self._remove(sha256)
+        return None
+
+    def get_near(self, sha256, image_hash):
+        """
+        Closest live entry within the Hamming threshold, or None (counted as a miss).
+        A hit is also stored under sha256 so the next identical upload is an exact hit.
+        """
+        now = time.monotonic()
+        best, best_distance = None, None
+        with self._lock:
+            candidates = set()
+            for index, key in zip(self._index, self._band_keys(image_hash)):
+                candidates.update(index.get(key, ()))
+            for candidate in candidates:
+                entry = self._entries[candidate]
+                if not self._live(entry, now):
+                    continue
+                distance = hamming(entry["phash"], image_hash)
+                if distance <= self.hamming_threshold and (best is None or distance < best_distance):
+                    best, best_distance = entry, distance
+            if best is None:
+                self.misses += 1
+                return None
+            self.near_hits += 1
+            self._add(sha256, best)
+            self._evict()
+        logger.debug("Near-duplicate upload, %d bits from a cached image", best_distance)
+        return best
+
+    def put(self, sha256, image_hash, embedding, matches):
+        entry = {
+            "phash": image_hash,
+            "embedding": np.asarray(embedding, dtype=np.float32),
+            "matches": matches,
+            "expires_at": time.monotonic() + self.ttl,
+        }
+        with self._lock:
+            self._add(sha256, entry)
+            self._evict()
+        return entry
+
+    def set_matches(self, entry, top_k, matches):
+        """
+        Add the top_k matches to a cached entry, which other requests may be reading.
+        """
+        with self._lock:
+            entry["matches"] = {**entry["matches"], top_k: matches}
+
+    def _evict(self):
+        while len(self._entries) > self.max_items:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index = [{} for _ in self._bands]
+
+    def stats(self):
+        lookups = self.exact_hits + self.near_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_items": self.max_items,
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.exact_hits + self.near_hits) / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = EmbeddingCache()
+    return _cache
@@ -0,0 +1,189 @@
+import asyncio
+import concurrent.futures
+import logging
+import os
+import queue
+import threading
+import time
+import numpy as np
+import torch
+from dotenv import load_dotenv
+import model_registry
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Config ---
+EMBED_MAX_BATCH_SIZE = int(os.getenv("EMBED_MAX_BATCH_SIZE", "16"))
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", "5"))
+
+_STOP = object()
+
+
+class EmbeddingService:
+    """
+    Micro-batching front end for CLIP image embeddings.
+
+    Preprocessed image tensors from any number of concurrent callers are queued and
+    encoded together on one worker thread. A batch is flushed as soon as it holds
+    max_batch_size images or max_wait_ms has passed since its first image arrived.
+    """
+
+    def __init__(self, max_batch_size=EMBED_MAX_BATCH_SIZE, max_wait_ms=EMBED_MAX_WAIT_MS,
+                 model_name=model_registry.DEFAULT_MODEL, device=None):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.model_name = model_name
+        self.device = device or model_registry.default_device()
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopped = False
+        self._batches = 0
+        self._images = 0
+
+    def start(self):
+        with self._start_lock:
+            self._stopped = False
+            self._start_thread()
+
+    def _start_thread(self):
+        # Caller holds _start_lock
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="clip-embedder", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        with self._start_lock:
+            self._stopped = True
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+        # Fail whatever was queued behind the stop sentinel rather than leave it pending
+        with self._start_lock:
+            self._fail_queued()
+
+    def _fail_queued(self):
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP and item[1].set_running_or_notify_cancel():
+                item[1].set_exception(RuntimeError("Embedding service stopped"))
+
+    def _enqueue(self, tensors, single):
+        future = concurrent.futures.Future()
+        # Under the lock, so nothing is queued after stop() has drained the queue
+        with self._start_lock:
+            if self._stopped:
+                future.set_exception(RuntimeError("Embedding service stopped"))
+                return future
+            self._start_thread()
+            self._queue.put((tensors, future, single))
+        return future
+
+    def submit(self, image_tensor):
+        """
+        Queue one preprocessed image, shape (3, H, W) or (1, 3, H, W).
+        Returns a concurrent.futures.Future that resolves to the normalized embedding.
+        """
+        if image_tensor.dim() == 3:
+            image_tensor = image_tensor.unsqueeze(0)
+        return self._enqueue(image_tensor, True)
+
+    def submit_batch(self, image_tensors):
+        """
+        Queue many images as one unit, shape (N, 3, H, W) or a list of (3, H, W).
+        The future resolves to an (N, D) array of normalized embeddings.
+        """
+        if isinstance(image_tensors, (list, tuple)):
+            image_tensors = torch.stack(list(image_tensors))
+        return self._enqueue(image_tensors, False)
+
+    async def embed(self, image_tensor):
+        """
+        Awaitable version of submit(); the event loop stays free while the batch runs.
+        """
+        return await asyncio.wrap_future(self.submit(image_tensor))
+
+    async def embed_batch(self, image_tensors):
+        return await asyncio.wrap_future(self.submit_batch(image_tensors))
+
+    def embed_many(self, image_tensors):
+        """
+        Blocking helper: embed a list of tensors, returning an (N, D) array.
+        """
+        return self.submit_batch(image_tensors).result()
+
+    def stats(self):
+        return {
+            "batches": self._batches,
+            "images": self._images,
+            "avg_batch_size": round(self._images / self._batches, 2) if self._batches else 0.0,
+            "queued": self._queue.qsize(),
+        }
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            size = len(item[0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                size += len(item[0])
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            model, _ = model_registry.get_model(self.model_name, self.device)
+            inputs = torch.cat([tensors for tensors, _, _ in batch]).to(self.device)
+            with torch.no_grad():
+                features = model.encode_image(inputs)
+            embeddings = features.float().cpu().numpy()
+            embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+        except Exception as e:
+            logger.error(f"CLIP batch of {len(batch)} requests failed: {str(e)}", exc_info=True)
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        self._batches += 1
+        self._images += len(embeddings)
+        offset = 0
+        for tensors, future, single in batch:
+            rows = embeddings[offset:offset + len(tensors)]
+            offset += len(tensors)
+            future.set_result(rows[0] if single else rows)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_embedding_service():
+    """
+    Process-wide EmbeddingService, created on first use.
+    """
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = EmbeddingService()
+    return _service
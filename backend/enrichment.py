@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from dotenv import load_dotenv
+from claude_utils import summarize_wikipedia_url
+import resilience
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Config ---
+ENRICH_CONCURRENCY = int(os.getenv("ENRICH_CONCURRENCY", "5"))
+ENRICH_TIMEOUT = float(os.getenv("ENRICH_TIMEOUT", "20"))
+
+NO_SUMMARY = "(No Wikipedia summary available)"
+
+# Bio summaries are blocking HTTP calls, so they run on their own bounded pool
+_executor = ThreadPoolExecutor(max_workers=ENRICH_CONCURRENCY, thread_name_prefix="enrich")
+
+
+async def summarize_artist(artist_id, metadata, semaphore, timeout=ENRICH_TIMEOUT):
+    """
+    Bio summary for one artist, falling back to NO_SUMMARY on error or timeout.
+    """
+    wikipedia_url = metadata.get("wikipedia")
+    if not wikipedia_url:
+        return NO_SUMMARY
+    async with semaphore:
+        # Never wait past the request budget, if one is set
+        timeout = resilience.remaining(timeout)
+        if timeout is not None and timeout <= 0:
+            logger.warning("No request budget left for the Wikipedia summary of %s", artist_id)
+            return NO_SUMMARY
+        loop = asyncio.get_running_loop()
+        try:
+            # Copy the context so the summarizer call sees the request deadline
+            bio = await asyncio.wait_for(
+                loop.run_in_executor(_executor, copy_context().run, summarize_wikipedia_url, wikipedia_url), timeout
+            )
+            logger.debug("Successfully summarized Wikipedia for %s", artist_id)
+            return bio
+        except asyncio.TimeoutError:
+            logger.error(f"Wikipedia summary timed out after {timeout}s for {artist_id}")
+        except Exception as e:
+            logger.error(f"Wikipedia summary failed for {artist_id}: {str(e)}")
+    return NO_SUMMARY
+
+
+def summarize_artists(metadata_by_id, concurrency=ENRICH_CONCURRENCY, timeout=ENRICH_TIMEOUT):
+    """
+    Start one bio summary task per artist. Returns {artist_id: asyncio.Task}, so callers
+    that share artists (e.g. every image of a batch) share the lookups too.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    return {
+        artist_id: asyncio.ensure_future(summarize_artist(artist_id, metadata, semaphore, timeout))
+        for artist_id, metadata in metadata_by_id.items()
+    }
+
+
+def build_artist_infos(similar_artists, metadata_by_id, bios_by_id):
+    """
+    (artist_infos, bio_summaries) for the matches that have metadata, in match order.
+    """
+    artist_infos = []
+    bio_summaries = {}
+    for artist_id, score in similar_artists:
+        metadata = metadata_by_id.get(int(artist_id))
+        if not metadata:
+            logger.warning(f"No metadata for artist_id: {artist_id}")
+            continue
+        bio_summaries[metadata.get("name", f"Artist_{artist_id}")] = bios_by_id.get(int(artist_id), NO_SUMMARY)
+        artist_infos.append({"artist_id": artist_id, "score": score, "metadata": metadata})
+    return artist_infos, bio_summaries
+
+
+async def enrich_artists(similar_artists, metadata_by_id, concurrency=ENRICH_CONCURRENCY, timeout=ENRICH_TIMEOUT):
+    """
+    Attach metadata and bio summaries to (artist_id, score) matches concurrently.
+
+    Latency is that of the slowest artist rather than the sum. Artists with no
+    metadata are skipped, and the input order (by similarity score) is kept.
+    Returns (artist_infos, bio_summaries) in the shape generate_report expects.
+    """
+    matched = {}
+    for artist_id, _ in similar_artists:
+        logger.debug("Processing artist_id: %s", artist_id)
+        metadata = metadata_by_id.get(int(artist_id))
+        if metadata:
+            matched[int(artist_id)] = metadata
+
+    tasks = summarize_artists(matched, concurrency, timeout)
+    bios = await asyncio.gather(*tasks.values())
+    return build_artist_infos(similar_artists, metadata_by_id, dict(zip(tasks, bios)))
+
+
+def frontend_rows(artist_infos, bio_summaries):
+    """
+    JSON rows for the attribution and analytics pages.
+    """
+    rows = []
+    for info in artist_infos:
+        metadata = info["metadata"]
+        rows.append({
+            "id": str(metadata.get("id", "Unknown")),
+            "name": str(metadata.get("name", "Unknown")),
+            "years": str(metadata.get("years", "Unknown")),
+            "genre": str(metadata.get("genre", "Unknown")),
+            "nationality": str(metadata.get("nationality", "Unknown")),
+            "similarity_score": float(round(info["score"] * 100, 2)),
+            "bio": str(bio_summaries.get(metadata.get("name", f"Artist_{info['artist_id']}"), "(No bio)"))
+        })
+    return rows
@@ -1,5 +1,13 @@
 from dotenv import load_dotenv
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import asyncio
+import copy
+import io
+import logging
+import multiprocessing
 import os
+import threading
 import reportlab.lib.pagesizes as pagesizes
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
@@ -8,6 +16,27 @@ from reportlab.lib.units import inch
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# --- Config ---
+# Worker processes for PDF rendering; 0 renders on a thread in the server process
+REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", "2"))
+# Reports queued or rendering at once before render_report refuses more
+REPORT_MAX_QUEUE = int(os.getenv("REPORT_MAX_QUEUE", "16"))
+LOGO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "trumuse_logo.png")
+
+# --- Static assets, built once per process ---
+STYLES = getSampleStyleSheet()
+CUSTOM_STYLE = ParagraphStyle(name='Custom', parent=STYLES['Normal'], fontSize=12, leading=14)
+with open(LOGO_PATH, "rb") as _f:
+    LOGO_BYTES = _f.read()
+# lazy=0 decodes the PNG now, so every report reuses the decoded image
+LOGO = Image(io.BytesIO(LOGO_BYTES), width=1*inch, height=1*inch, lazy=0)
+
+
+class ReportQueueFull(Exception):
+    pass
+
 def to_roman_numeral(num):
     roman_values = [
         (1000, "M"), (900, "CM"), (500, "D"), (400, "CD"),
@@ -23,12 +52,11 @@ def to_roman_numeral(num):
 
 def generate_attribution_report(image_path, output, artist_infos, bio_summaries):
     doc = SimpleDocTemplate(output, pagesize=pagesizes.A4)
-    styles = getSampleStyleSheet()
-    custom_style = ParagraphStyle(name='Custom', parent=styles['Normal'], fontSize=12, leading=14)
+    styles = STYLES
+    custom_style = CUSTOM_STYLE
     
     story = []
-    logo = Image('trumuse_logo.png', width=1*inch, height=1*inch)
-    story.append(logo)
+    story.append(copy.copy(LOGO))
     story.append(Spacer(1, 12))
     
     title = "Attribution Report"
@@ -65,7 +93,78 @@ def generate_attribution_report(image_path, output, artist_infos, bio_summaries)
     
     doc.build(story)
 
-if __name__ == "_main_":
+def render_report_bytes(artist_infos, bio_summaries):
+    output = io.BytesIO()
+    generate_attribution_report(None, output, artist_infos, bio_summaries)
+    return output.getvalue()
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = 0
+_pending_lock = threading.Lock()
+
+def get_report_executor():
+    global _executor
+    if REPORT_WORKERS <= 0:
+        return None
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # spawn, not fork: the server process has torch threads running.
+                # Spawned workers re-import __main__, so the app is started through
+                # uvicorn or serve.py, never as `python main.py` (see main.py)
+                _executor = ProcessPoolExecutor(
+                    max_workers=REPORT_WORKERS, mp_context=multiprocessing.get_context("spawn")
+                )
+    return _executor
+
+def shutdown_report_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+def reset_report_executor(broken):
+    """
+    Replace the pool after one of its workers died (a broken pool fails every
+    later submit). Only the caller holding the broken pool resets it, so
+    concurrent failures don't throw away a fresh replacement.
+    """
+    global _executor
+    with _executor_lock:
+        if broken is not None and _executor is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+async def render_report(artist_infos, bio_summaries):
+    """
+    Render the attribution report PDF off the event loop and return its bytes.
+    Raises ReportQueueFull when REPORT_MAX_QUEUE reports are already pending.
+    """
+    global _pending
+    with _pending_lock:
+        if _pending >= REPORT_MAX_QUEUE:
+            raise ReportQueueFull(f"{_pending} reports already pending")
+        _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        executor = get_report_executor()
+        try:
+            return await loop.run_in_executor(executor, render_report_bytes, artist_infos, bio_summaries)
+        except BrokenProcessPool:
+            # A worker died (OOM, crash in reportlab/PIL); retry once on a new pool
+            logger.warning("Report worker pool broke, restarting it")
+            reset_report_executor(executor)
+            return await loop.run_in_executor(get_report_executor(), render_report_bytes, artist_infos, bio_summaries)
+    finally:
+        with _pending_lock:
+            _pending -= 1
+
+def report_queue_depth():
+    return _pending
+
+if __name__ == "__main__":
     with open('test.pdf', 'wb') as f:
         artist_infos = [{"artist_id": 0, "score": 0.9, "metadata": {"name": "Artist0", "genre": "Painting", "nationality": "Unknown", "wikipedia": "https://example.com"}}]
         bio_summaries = {"Artist0": "Sample bio"}
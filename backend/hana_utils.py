@@ -1,42 +1,237 @@
-import hana_ml.dataframe as dataframe
-from hana_ml.dataframe import ConnectionContext
 from dotenv import load_dotenv
+from contextlib import contextmanager
+import csv
+import logging
 import os
+import queue
+import sqlite3
+import threading
+import time
 
 # Load .env file
 load_dotenv()
 
-def get_artist_metadata(artist_id) -> dict:
-    conn = ConnectionContext(
+logger = logging.getLogger(__name__)
+
+ARTIST_COLUMNS = ("id", "name", "years", "genre", "nationality", "bio", "wikipedia", "paintings")
+
+# --- Pool config ---
+HANA_POOL_SIZE = int(os.getenv("HANA_POOL_SIZE", "4"))
+# Connections idle for longer than this are pinged before being handed out
+HANA_POOL_PING_AFTER = float(os.getenv("HANA_POOL_PING_AFTER", "30"))
+HANA_POOL_TIMEOUT = float(os.getenv("HANA_POOL_TIMEOUT", "10"))
+
+
+class ConnectionPool:
+    """
+    Small thread-safe pool of DB-API connections.
+
+    connect is a zero-argument callable returning a new connection. Connections are
+    created lazily up to max_size, health-checked with health_check_sql when they have
+    been idle for a while, and replaced when they fail.
+    """
+
+    def __init__(self, connect, max_size=HANA_POOL_SIZE, health_check_sql="SELECT 1 FROM DUMMY",
+                 ping_after=HANA_POOL_PING_AFTER, timeout=HANA_POOL_TIMEOUT):
+        self._connect = connect
+        self.max_size = max_size
+        self.health_check_sql = health_check_sql
+        self.ping_after = ping_after
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _new_connection(self):
+        conn = self._connect()
+        logger.debug("Opened new database connection")
+        return conn
+
+    def _is_healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(self.health_check_sql)
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            return True
+        except Exception as e:
+            logger.warning(f"Discarding unhealthy database connection: {str(e)}")
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    def acquire(self):
+        while True:
+            try:
+                conn, idle_since = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    can_create = self._created < self.max_size
+                    if can_create:
+                        self._created += 1
+                if can_create:
+                    try:
+                        return self._new_connection()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        raise
+                try:
+                    conn, idle_since = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise TimeoutError("Timed out waiting for a database connection")
+
+            if time.monotonic() - idle_since < self.ping_after or self._is_healthy(conn):
+                return conn
+            self._discard(conn)
+
+    def release(self, conn, broken=False):
+        if broken:
+            self._discard(conn)
+        else:
+            self._idle.put((conn, time.monotonic()))
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            self.release(conn, broken=not self._is_healthy(conn))
+            raise
+        else:
+            self.release(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+def _connect_hana():
+    from hdbcli import dbapi
+    return dbapi.connect(
         address=os.getenv("HANA_HOST"),
         port=int(os.getenv("HANA_PORT")),
         user=os.getenv("HANA_USER"),
         password=os.getenv("HANA_PASSWORD")
     )
 
-    # Force to int just to avoid surprises
-    artist_id = int(artist_id)
 
-    sql = f'SELECT * FROM ARTIST_METADATA WHERE "id" = {artist_id}'
-    print(f"🚨 Executing Query: {sql}")
+def create_sqlite_pool(csv_path=None, database="file:artist_metadata?mode=memory&cache=shared",
+                       max_size=HANA_POOL_SIZE):
+    """
+    Local stand-in for HANA: an SQLite ARTIST_METADATA table behind the same pool
+    interface, optionally seeded from artists.csv.
+    """
+    def connect():
+        return sqlite3.connect(database, uri=database.startswith("file:"), check_same_thread=False)
 
-    df = conn.sql(sql).collect()
+    pool = ConnectionPool(connect, max_size=max_size, health_check_sql="SELECT 1")
+    # Hold one connection open so a shared in-memory database outlives its users
+    pool.keepalive = connect()
+    columns = ", ".join(f'"{c}"' for c in ARTIST_COLUMNS)
+    pool.keepalive.execute(f'CREATE TABLE IF NOT EXISTS ARTIST_METADATA ({columns})')
+    if csv_path:
+        rows = [tuple(m[c] for c in ARTIST_COLUMNS) for m in load_artists_csv(csv_path).values()]
+        placeholders = ", ".join("?" for _ in ARTIST_COLUMNS)
+        pool.keepalive.execute("DELETE FROM ARTIST_METADATA")
+        pool.keepalive.executemany(f"INSERT INTO ARTIST_METADATA VALUES ({placeholders})", rows)
+        pool.keepalive.commit()
+    return pool
 
-    if df.empty:
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(_connect_hana)
+    return _pool
+
+
+def set_pool(pool):
+    """
+    Swap the metadata backend, e.g. for create_sqlite_pool() in tests and benchmarks.
+    """
+    global _pool
+    _pool = pool
+
+
+def get_artists_metadata(artist_ids) -> dict:
+    """
+    Fetch metadata for several artists in one parameterised query.
+    Returns {artist_id: metadata}; ids with no row are left out.
+    """
+    ids = list(dict.fromkeys(int(i) for i in artist_ids))
+    if not ids:
         return {}
 
-    row = df.iloc[0]
-    return {
-        "id": row["id"],
-        "name": row["name"],
-        "years": row["years"],
-        "genre": row["genre"],
-        "nationality": row["nationality"],
-        "bio": row["bio"],
-        "wikipedia": row["wikipedia"],
-        "paintings": row["paintings"]
-    }
-
-if __name__ == "_main_":
+    columns = ", ".join(f'"{c}"' for c in ARTIST_COLUMNS)
+    placeholders = ", ".join("?" for _ in ids)
+    sql = f'SELECT {columns} FROM ARTIST_METADATA WHERE "id" IN ({placeholders})'
+    logger.debug("Fetching metadata for %d artists", len(ids))
+
+    with get_pool().connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql, ids)
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+
+    return {int(row[0]): dict(zip(ARTIST_COLUMNS, row)) for row in rows}
+
+
+def get_all_artists_metadata() -> dict:
+    """
+    Fetch the whole ARTIST_METADATA table as {artist_id: metadata}.
+    """
+    columns = ", ".join(f'"{c}"' for c in ARTIST_COLUMNS)
+    with get_pool().connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"SELECT {columns} FROM ARTIST_METADATA")
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+    return {int(row[0]): dict(zip(ARTIST_COLUMNS, row)) for row in rows}
+
+
+def load_artists_csv(csv_path) -> dict:
+    """
+    Read artists.csv (the offline mirror of ARTIST_METADATA) as {artist_id: metadata}.
+    """
+    artists = {}
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            metadata = {c: row[c] for c in ARTIST_COLUMNS}
+            metadata["id"] = int(metadata["id"])
+            metadata["paintings"] = int(metadata["paintings"])
+            artists[metadata["id"]] = metadata
+    return artists
+
+
+def get_artist_metadata(artist_id) -> dict:
+    # Force to int just to avoid surprises
+    artist_id = int(artist_id)
+    return get_artists_metadata([artist_id]).get(artist_id, {})
+
+if __name__ == "__main__":
     from pprint import pprint
-    pprint(get_artist_metadata(0))
\ No newline at end of file
+    pprint(get_artist_metadata(0))
@@ -1,25 +1,39 @@
 import torch
-import clip
-from PIL import Image
-Image.MAX_IMAGE_PIXELS = None
+import torch.nn.functional as F
 import numpy as np
 import cv2
 from torchvision import transforms
 import io
+import os
+import model_registry
+from image_io import decode_image
+from embedding_cache import content_hash
+from patch_cache import get_patch_cache
+from metrics import span
 
-# --- Load CLIP model ---
-device = "cuda" if torch.cuda.is_available() else "cpu"
-model, preprocess = clip.load("ViT-B/32", device=device)
+# --- CLIP model (shared with vector_utils through the registry) ---
+device = model_registry.default_device()
+
+def get_model():
+    return model_registry.get_model(device=device)
 
 # --- Config ---
 PATCH_SIZE = 32
+# "crops": every patch is upscaled as a tensor and encoded in batches (matches the
+# original per-patch maps). "tokens": one forward pass, using the ViT patch tokens.
+# "tokens" is an approximation: it embeds patches in context rather than as
+# separate crops, so it does not meet the per-patch regression gate.
+HEATMAP_ENGINE = os.getenv("HEATMAP_ENGINE", "crops")
+HEATMAP_BATCH_SIZE = int(os.getenv("HEATMAP_BATCH_SIZE", "64"))
+
+# Same normalisation constants as clip's preprocess
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
 
 # --- Load and process image ---
-def load_image(path, max_size=512):
-    img = Image.open(path).convert("RGB")
-    if img.size[0] > max_size or img.size[1] > max_size:
-        img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-    return img
+def load_image(source, max_size=512):
+    # source can be a path, the uploaded bytes or an already decoded PIL image
+    return decode_image(source, max_size=max_size)
 
 def split_into_patches(image, patch_size):
     transform = transforms.ToTensor()
@@ -29,7 +43,12 @@ def split_into_patches(image, patch_size):
     patches = patches.contiguous().view(c, -1, patch_size, patch_size).permute(1, 0, 2, 3)
     return patches, h, w
 
-def get_patch_embeddings(patches):
+def get_patch_embeddings_per_patch(patches):
+    """
+    Reference implementation: one PIL round-trip and one CLIP forward per patch.
+    Slow, kept only to check the batched engines against.
+    """
+    model, preprocess = get_model()
     embeddings = []
     for patch in patches:
         img = transforms.ToPILImage()(patch)
@@ -39,6 +58,71 @@ def get_patch_embeddings(patches):
         embeddings.append(emb)
     return torch.stack(embeddings)
 
+def _normalize(batch):
+    mean = torch.tensor(CLIP_MEAN, device=batch.device).view(1, 3, 1, 1)
+    std = torch.tensor(CLIP_STD, device=batch.device).view(1, 3, 1, 1)
+    return (batch - mean) / std
+
+def get_patch_embeddings(patches, batch_size=HEATMAP_BATCH_SIZE):
+    """
+    Embed every patch with CLIP, upscaling on the tensor side and running the
+    encoder on batches of patches instead of one patch at a time.
+    """
+    model, _ = get_model()
+    input_size = getattr(model, "eager_visual", model.visual).input_resolution
+    embeddings = []
+    with torch.no_grad():
+        for start in range(0, patches.shape[0], batch_size):
+            batch = patches[start:start + batch_size].to(device)
+            batch = F.interpolate(batch, size=(input_size, input_size), mode="bicubic", align_corners=False)
+            # preprocess works on uint8 pixels, so clamp and quantise the same way
+            batch = torch.round(batch.clamp(0, 1) * 255) / 255
+            batch = _normalize(batch).to(model.dtype)
+            embeddings.append(model.encode_image(batch))
+    return torch.cat(embeddings)
+
+def get_patch_token_embeddings(image):
+    """
+    Embed every PATCH_SIZE patch of the image in a single forward pass.
+    The image is run through the ViT at its own resolution (one token per patch,
+    positional embeddings interpolated to the patch grid) and each patch token is
+    projected into the joint embedding space with ln_post/proj.
+    Returns (embeddings, h, w) with embeddings in row-major patch order.
+    """
+    model, _ = get_model()
+    # The layers are called one by one, so use the uncompiled encoder
+    visual = getattr(model, "eager_visual", model.visual)
+    img_tensor = transforms.ToTensor()(image)
+    _, h, w = img_tensor.shape
+    grid_h, grid_w = h // PATCH_SIZE, w // PATCH_SIZE
+    x = img_tensor[:, :grid_h * PATCH_SIZE, :grid_w * PATCH_SIZE].unsqueeze(0).to(device)
+    x = _normalize(x).to(model.dtype)
+
+    with torch.no_grad():
+        x = visual.conv1(x)
+        x = x.reshape(x.shape[0], x.shape[1], -1).permute(0, 2, 1)
+        cls = visual.class_embedding.to(x.dtype) + torch.zeros(x.shape[0], 1, x.shape[-1], dtype=x.dtype, device=x.device)
+        x = torch.cat([cls, x], dim=1)
+        x = x + _interpolate_positional_embedding(visual.positional_embedding, grid_h, grid_w).to(x.dtype)
+        x = visual.ln_pre(x)
+        x = x.permute(1, 0, 2)
+        x = visual.transformer(x)
+        x = x.permute(1, 0, 2)
+        x = visual.ln_post(x[:, 1:, :])
+        if visual.proj is not None:
+            x = x @ visual.proj
+    return x.squeeze(0), h, w
+
+def _interpolate_positional_embedding(pos_embedding, grid_h, grid_w):
+    cls_pos, patch_pos = pos_embedding[:1], pos_embedding[1:]
+    side = int(patch_pos.shape[0] ** 0.5)
+    if (side, side) == (grid_h, grid_w):
+        return pos_embedding
+    patch_pos = patch_pos.reshape(1, side, side, -1).permute(0, 3, 1, 2).float()
+    patch_pos = F.interpolate(patch_pos, size=(grid_h, grid_w), mode="bicubic", align_corners=False)
+    patch_pos = patch_pos.permute(0, 2, 3, 1).reshape(grid_h * grid_w, -1).to(pos_embedding.dtype)
+    return torch.cat([cls_pos, patch_pos], dim=0)
+
 def compute_similarity(patch_embs, reference_emb):
     patch_embs = patch_embs / patch_embs.norm(dim=1, keepdim=True)
     reference_emb = reference_emb / reference_emb.norm()
@@ -72,23 +156,153 @@ def overlay_heatmap(original_img, heatmap, output_buffer):
     _, buffer = cv2.imencode('.jpg', blended)
     output_buffer.write(buffer.tobytes())
 
-def generate_heatmap(original_path, ai_path, output_buffer):
-    # Load both images
+def get_image_embedding(image):
+    model, preprocess = get_model()
+    tensor = preprocess(image).unsqueeze(0).to(device)
+    with torch.no_grad():
+        return model.encode_image(tensor).squeeze(0)
+
+def get_image_embeddings(images, batch_size=HEATMAP_BATCH_SIZE):
+    """
+    Unit-normalised embeddings of whole images as an (N, D) tensor, encoded in batches.
+    """
+    model, preprocess = get_model()
+    embeddings = []
+    with torch.no_grad():
+        for start in range(0, len(images), batch_size):
+            batch = torch.stack([preprocess(img) for img in images[start:start + batch_size]]).to(device)
+            embeddings.append(model.encode_image(batch).float().cpu())
+    embeddings = torch.cat(embeddings)
+    return embeddings / embeddings.norm(dim=1, keepdim=True)
+
+def get_patch_grid(original_img, engine):
+    if engine == "tokens":
+        return get_patch_token_embeddings(original_img)
+    original_patches, h, w = split_into_patches(original_img, PATCH_SIZE)
+    if engine == "per_patch":
+        return get_patch_embeddings_per_patch(original_patches), h, w
+    return get_patch_embeddings(original_patches), h, w
+
+def source_hash(source):
+    # Content hash of upload bytes or a file; None for images already decoded
+    if isinstance(source, (bytes, bytearray)):
+        return content_hash(bytes(source))
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return content_hash(f.read())
+    return None
+
+def get_original_grid(original_img, original_hash=None, engine=None):
+    """
+    Unit-normalised patch embeddings of the original as (embeddings, h, w), taken
+    from the patch cache when the same image was embedded before.
+    """
+    engine = engine or HEATMAP_ENGINE
+    key = (original_hash, engine, original_img.size) if original_hash else None
+    if key is not None:
+        cached = get_patch_cache().get(key)
+        if cached is not None:
+            return cached
+
+    with span("patch_embed", pipeline="heatmap"):
+        embeddings, h, w = get_patch_grid(original_img, engine)
+        embeddings = embeddings.float().cpu()
+        embeddings = embeddings / embeddings.norm(dim=1, keepdim=True)
+    if key is None:
+        return embeddings, h, w
+    return get_patch_cache().put(key, embeddings, h, w)
+
+def compute_patch_heatmap(original_img, ai_img, engine=None):
+    """
+    Similarity of every patch of original_img to the whole of ai_img, as a
+    (grid_h, grid_w) numpy array.
+    """
+    engine = engine or HEATMAP_ENGINE
+    with span("patch_embed", pipeline="heatmap"):
+        patch_embeddings, h, w = get_patch_grid(original_img, engine)
+
+    with span("image_embed", pipeline="heatmap"):
+        ai_embedding = get_image_embedding(ai_img)
+    similarities = compute_similarity(patch_embeddings.float(), ai_embedding.float())
+    return create_heatmap(similarities, h, w, PATCH_SIZE)
+
+def compare_with_reference(original_path, ai_path, engine=None):
+    """
+    Check a batched engine against the per-patch reference maps.
+    Returns the max absolute difference and the Pearson correlation of the two maps.
+    """
     original_img = load_image(original_path)
     ai_img = load_image(ai_path)
+    reference = compute_patch_heatmap(original_img, ai_img, engine="per_patch")
+    candidate = compute_patch_heatmap(original_img, ai_img, engine=engine)
+    return {
+        "max_abs_diff": float(np.max(np.abs(reference - candidate))),
+        "correlation": float(np.corrcoef(reference.ravel(), candidate.ravel())[0, 1]),
+    }
 
-    # Split original image into patches and get embeddings
-    original_patches, h, w = split_into_patches(original_img, PATCH_SIZE)
-    patch_embeddings = get_patch_embeddings(original_patches)
+def generate_heatmaps(original_path, ai_paths):
+    """
+    One heatmap JPEG (bytes) per AI image, each against the same original.
+    The original's patch grid is computed once, or reused from the patch cache,
+    and all AI images are embedded in one batch.
+    """
+    with span("decode", pipeline="heatmap"):
+        original_img = load_image(original_path)
+        ai_imgs = [load_image(ai_path) for ai_path in ai_paths]
 
-    # Get full image embedding for AI image
-    ai_tensor = preprocess(ai_img).unsqueeze(0).to(device)
-    with torch.no_grad():
-        ai_embedding = model.encode_image(ai_tensor).squeeze(0)
+    grid, h, w = get_original_grid(original_img, source_hash(original_path))
+    with span("image_embed", pipeline="heatmap"):
+        ai_embeddings = get_image_embeddings(ai_imgs)
+
+    # Similarity of each patch of the original to each whole AI image, one row per AI image
+    similarities = ai_embeddings @ grid.T
+    heatmaps = []
+    with span("overlay", pipeline="heatmap"):
+        for row in similarities:
+            buffer = io.BytesIO()
+            overlay_heatmap(original_img, create_heatmap(row, h, w, PATCH_SIZE), buffer)
+            heatmaps.append(buffer.getvalue())
+    return heatmaps
+
+def generate_heatmap(original_path, ai_path, output_buffer):
+    # original_path / ai_path: file paths, image bytes or PIL images
+    output_buffer.write(generate_heatmaps(original_path, [ai_path])[0])
+
+# (min correlation, max absolute difference) against the per-patch maps. Only
+# engines listed here are gated; "tokens" is reported but not held to them.
+REFERENCE_LIMITS = {"crops": (0.98, 0.05)}
+
+def main():
+    # Regression check: python heatmap_generator.py original.jpg ai.jpg --engines crops,tokens
+    import argparse
+    import json
+    import sys
+    parser = argparse.ArgumentParser(description="Check the batched heatmap engines against the per-patch maps")
+    parser.add_argument("original")
+    parser.add_argument("ai")
+    parser.add_argument("--engines", default="crops,tokens")
+    parser.add_argument("--min-correlation", type=float, default=None,
+                        help="Fail below this Pearson correlation (default: REFERENCE_LIMITS; "
+                             "engines without limits are only reported)")
+    parser.add_argument("--max-abs-diff", type=float, default=None,
+                        help="Fail above this max absolute difference (default: REFERENCE_LIMITS)")
+    args = parser.parse_args()
 
-    # Compute similarity + heatmap
-    similarities = compute_similarity(patch_embeddings, ai_embedding)
-    heatmap = create_heatmap(similarities, h, w, PATCH_SIZE)
+    report = {}
+    for engine in [e for e in args.engines.split(",") if e]:
+        result = compare_with_reference(args.original, args.ai, engine=engine)
+        limits = REFERENCE_LIMITS.get(engine)
+        if args.min_correlation is not None or args.max_abs_diff is not None:
+            default_correlation, default_diff = limits or (-1.0, float("inf"))
+            limits = (default_correlation if args.min_correlation is None else args.min_correlation,
+                      default_diff if args.max_abs_diff is None else args.max_abs_diff)
+        if limits is None:
+            result["passed"] = None  # not gated
+        else:
+            result["passed"] = result["correlation"] >= limits[0] and result["max_abs_diff"] <= limits[1]
+        report[engine] = result
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if all(r["passed"] is not False for r in report.values()) else 1)
 
-    # Overlay heatmap on original image
-    overlay_heatmap(original_img, heatmap, output_buffer)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+from dotenv import load_dotenv
+from PIL import Image
+import io
+import os
+
+load_dotenv()
+
+# --- Config ---
+# Hard cap on decoded pixels. PIL warns above this and refuses above twice this,
+# which keeps a small upload from expanding into gigabytes of pixels.
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(8192 * 8192)))
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Smallest size the CLIP preprocess needs; JPEGs are decoded at no less than this
+CLIP_DECODE_SIZE = 224
+
+
+def decode_image(source, max_size=None, min_size=None):
+    """
+    Decode an image from bytes, a file path or an open PIL image into RGB.
+
+    For JPEGs, draft() makes libjpeg decode at a reduced scale (1/2, 1/4 or 1/8) that
+    is still at least max_size (or min_size) on both sides, so full-resolution pixels
+    are never materialised. With max_size the result is thumbnailed to fit in a
+    max_size square, like heatmap_generator's original load_image.
+    """
+    if isinstance(source, Image.Image):
+        img = source
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        img = Image.open(io.BytesIO(source))
+    else:
+        img = Image.open(source)
+
+    target = max_size or min_size
+    if target and img.format == "JPEG":
+        img.draft("RGB", (target, target))
+    img = img.convert("RGB")
+    if max_size and (img.size[0] > max_size or img.size[1] > max_size):
+        img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+    return img
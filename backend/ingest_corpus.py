@@ -0,0 +1,326 @@
+"""
+Build or update the artist embedding index from a directory of paintings.
+
+    python ingest_corpus.py /data/paintings --workers 8 --batch-size 256
+
+Paintings are matched to artists by their folder name or file name
+(e.g. Claude_Monet/12.jpg or Claude_Monet_12.jpg), either the artist id or the
+name as in artists.csv. Each run only embeds images whose content hash is not in
+the ingest state yet, so re-runs after adding a handful of paintings are cheap and
+an interrupted run picks up where it stopped.
+"""
+from dotenv import load_dotenv
+import argparse
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import time
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+import model_registry
+from hana_utils import load_artists_csv
+from vector_store import VECTOR_STORE, create_vector_store, _kmeans
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff"}
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _name_key(name):
+    return re.sub(r"[^a-z0-9]+", "", name.lower())
+
+
+class ArtistResolver:
+    """
+    Map a painting path to an artist id using artists.csv.
+    """
+
+    def __init__(self, csv_path):
+        artists = load_artists_csv(csv_path)
+        self.ids = set(artists)
+        self.by_name = {_name_key(a["name"]): artist_id for artist_id, a in artists.items()}
+
+    def _lookup(self, token):
+        if token.isdigit() and int(token) in self.ids:
+            return int(token)
+        return self.by_name.get(_name_key(token))
+
+    def resolve(self, path):
+        parent = os.path.basename(os.path.dirname(path))
+        artist_id = self._lookup(parent)
+        if artist_id is None:
+            # Flat layout: "Claude_Monet_12.jpg"
+            stem = re.sub(r"[_\-\s]*\d+$", "", os.path.splitext(os.path.basename(path))[0])
+            artist_id = self._lookup(stem)
+        return artist_id
+
+
+class IngestState:
+    """
+    Checkpoint of everything already embedded, in SQLite so runs can resume.
+
+    Embeddings are kept per content hash so artist centroids can be recomputed
+    without re-embedding anything.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "path TEXT PRIMARY KEY, sha256 TEXT, size INTEGER, mtime REAL, artist_id INTEGER, embedding BLOB)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS images_sha ON images (sha256)")
+        self.conn.commit()
+
+    def unchanged(self, path, size, mtime):
+        row = self.conn.execute("SELECT size, mtime FROM images WHERE path = ?", (path,)).fetchone()
+        return row is not None and row[0] == size and row[1] == mtime
+
+    def embedding_for_hash(self, sha256):
+        row = self.conn.execute(
+            "SELECT embedding FROM images WHERE sha256 = ? AND embedding IS NOT NULL LIMIT 1", (sha256,)
+        ).fetchone()
+        return None if row is None else np.frombuffer(row[0], dtype=np.float32)
+
+    def stale_painting_ids(self, rows):
+        """
+        Painting ids of the content these rows replace: a path whose file changed
+        (or moved artist) leaves its old vector behind unless another path still
+        has that content.
+        """
+        new_ids = {painting_id(r[4], r[1]) for r in rows}
+        changed = {r[0] for r in rows}
+        stale = set()
+        for path, *_ in rows:
+            old = self.conn.execute("SELECT sha256, artist_id FROM images WHERE path = ?", (path,)).fetchone()
+            if old is None or painting_id(old[1], old[0]) in new_ids:
+                continue
+            others = [p for (p,) in self.conn.execute(
+                "SELECT path FROM images WHERE sha256 = ? AND artist_id = ?", (old[0], old[1])
+            ) if p not in changed]
+            if not others:
+                stale.add(painting_id(old[1], old[0]))
+        return sorted(stale)
+
+    def record(self, rows):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO images (path, sha256, size, mtime, artist_id, embedding) VALUES (?, ?, ?, ?, ?, ?)",
+            [(p, h, s, m, a, e.astype(np.float32).tobytes()) for p, h, s, m, a, e in rows]
+        )
+        self.conn.commit()
+
+    def centroids(self, per_artist=1):
+        """
+        {artist_id: (k, D) array}: the mean painting vector, or with per_artist > 1 up to
+        that many k-means centroids of the artist's paintings.
+        """
+        vectors = {}
+        for artist_id, blob in self.conn.execute("SELECT artist_id, embedding FROM images"):
+            vectors.setdefault(artist_id, []).append(np.frombuffer(blob, dtype=np.float32))
+        centroids = {}
+        for artist_id, rows in vectors.items():
+            rows = np.stack(rows)
+            if per_artist > 1 and len(rows) > 1:
+                centroids[artist_id], _ = _kmeans(rows, per_artist)
+            else:
+                centroids[artist_id] = rows.mean(axis=0, keepdims=True)
+        return centroids
+
+
+def painting_id(artist_id, sha256):
+    return f"{artist_id}-{sha256[:16]}"
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scan(root, resolver, state):
+    """
+    Yield (path, size, mtime, artist_id) for images that are new or changed since the last run.
+    """
+    skipped = unmatched = 0
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() not in IMAGE_EXTENSIONS:
+                continue
+            path = os.path.join(dirpath, filename)
+            stat = os.stat(path)
+            if state.unchanged(path, stat.st_size, stat.st_mtime):
+                skipped += 1
+                continue
+            artist_id = resolver.resolve(path)
+            if artist_id is None:
+                unmatched += 1
+                logger.warning(f"No artist matches {path}, skipping")
+                continue
+            yield path, stat.st_size, stat.st_mtime, artist_id
+    print(f"Skipped {skipped} unchanged images, {unmatched} with no matching artist")
+
+
+class PaintingDataset(Dataset):
+    """
+    Hashes and decodes paintings in DataLoader workers. Images whose hash is already
+    embedded are returned without pixels so only new content reaches CLIP.
+    """
+
+    def __init__(self, items, preprocess, known_hashes):
+        self.items = items
+        self.preprocess = preprocess
+        self.known_hashes = known_hashes
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, i):
+        path, size, mtime, artist_id = self.items[i]
+        sha256 = file_sha256(path)
+        tensor = None
+        if sha256 not in self.known_hashes:
+            try:
+                with Image.open(path) as img:
+                    img.draft("RGB", (448, 448))
+                    tensor = self.preprocess(img)
+            except Exception as e:
+                logger.warning(f"Could not decode {path}: {str(e)}")
+                return None
+        return path, size, mtime, artist_id, sha256, tensor
+
+
+def _collate(batch):
+    return [item for item in batch if item is not None]
+
+
+def ingest(root, csv_path, state_path, level="both", artists_index=None, paintings_index=None,
+           store_kind=VECTOR_STORE, batch_size=256, workers=4, upsert_chunk=100, centroids_per_artist=1,
+           flush_every=20):
+    resolver = ArtistResolver(csv_path)
+    state = IngestState(state_path)
+    items = list(scan(root, resolver, state))
+    print(f"{len(items)} new or changed images to process")
+
+    paintings_store = create_vector_store(store_kind, paintings_index) if level in ("painting", "both") else None
+    artists_store = create_vector_store(store_kind, artists_index) if level in ("artist", "both") else None
+
+    model, preprocess = model_registry.get_model()
+    device = model_registry.default_device()
+    known = {row[0] for row in state.conn.execute("SELECT DISTINCT sha256 FROM images")}
+    loader = DataLoader(PaintingDataset(items, preprocess, known), batch_size=batch_size,
+                        num_workers=workers, collate_fn=_collate)
+
+    start = time.perf_counter()
+    embedded = 0
+    pending = []
+
+    def checkpoint():
+        # Persist the index (a full rewrite for the local store), then the state rows it covers
+        if paintings_store is not None:
+            paintings_store.flush()
+        state.record(pending)
+        pending.clear()
+
+    for batches, batch in enumerate(loader, start=1):
+        fresh = [item for item in batch if item[5] is not None]
+        vectors = {}
+        if fresh:
+            inputs = torch.stack([item[5] for item in fresh]).to(device)
+            with torch.no_grad():
+                features = model.encode_image(inputs).float().cpu().numpy()
+            features /= np.linalg.norm(features, axis=1, keepdims=True)
+            vectors = {item[4]: vector for item, vector in zip(fresh, features)}
+            embedded += len(fresh)
+
+        rows = []
+        for path, size, mtime, artist_id, sha256, _ in batch:
+            vector = vectors.get(sha256)
+            if vector is None:
+                vector = state.embedding_for_hash(sha256)
+            if vector is not None:
+                rows.append((path, sha256, size, mtime, artist_id, vector))
+
+        if paintings_store is not None:
+            # Not content an earlier, not yet checkpointed batch has just written
+            written = {painting_id(r[4], r[1]) for r in pending}
+            stale = [i for i in state.stale_painting_ids(rows) if i not in written]
+            if stale:
+                paintings_store.delete(stale)
+            # Copies of one painting share an id; upsert it once
+            unique = list({painting_id(r[4], r[1]): r for r in rows}.items())
+            for i in range(0, len(unique), upsert_chunk):
+                chunk = unique[i:i + upsert_chunk]
+                paintings_store.upsert(
+                    [pid for pid, _ in chunk],
+                    [r[5] for _, r in chunk],
+                    [{"artist_id": int(r[4]), "sha256": r[1]} for _, r in chunk]
+                )
+        # Checkpoint only after the vectors are in the store
+        pending.extend(rows)
+        if batches % flush_every == 0:
+            checkpoint()
+
+        elapsed = time.perf_counter() - start
+        print(f"Embedded {embedded} images ({embedded / elapsed:.1f} images/sec)")
+    checkpoint()
+
+    if artists_store is not None:
+        centroids = state.centroids(centroids_per_artist)
+        # One centroid keeps the artist id as the vector id, as the flat retrieval mode expects
+        entries = [
+            (str(a) if centroids_per_artist == 1 else f"{a}-c{j}", vector, {"artist_id": int(a)})
+            for a in sorted(centroids) for j, vector in enumerate(centroids[a])
+        ]
+        for i in range(0, len(entries), upsert_chunk):
+            chunk = entries[i:i + upsert_chunk]
+            artists_store.upsert([e[0] for e in chunk], [e[1] for e in chunk], [e[2] for e in chunk])
+        artists_store.flush()
+        print(f"Updated {len(entries)} centroids for {len(centroids)} artists")
+
+    elapsed = time.perf_counter() - start
+    rate = embedded / elapsed if elapsed else 0.0
+    print(f"Done: {embedded} images embedded in {elapsed:.1f}s ({rate:.1f} images/sec)")
+    return {"embedded": embedded, "seconds": elapsed, "images_per_sec": rate}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed a directory of paintings into the vector store.")
+    parser.add_argument("root", help="Directory of paintings, one folder per artist or Artist_Name_N.jpg files")
+    parser.add_argument("--artists-csv", default=os.path.join(BASE_DIR, "artists.csv"))
+    parser.add_argument("--state", default=os.path.join(BASE_DIR, "ingest_state.sqlite3"),
+                        help="Checkpoint / content-hash skip list")
+    parser.add_argument("--level", choices=["artist", "painting", "both"], default="both",
+                        help="Write per-artist centroids, per-painting vectors, or both")
+    parser.add_argument("--store", default=VECTOR_STORE, choices=["local", "pinecone"])
+    parser.add_argument("--artists-index", default=None, help="Index for artist centroids (default: configured index)")
+    parser.add_argument("--paintings-index", default=os.getenv("PAINTINGS_INDEX"),
+                        help="Index for painting vectors")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--upsert-chunk", type=int, default=100)
+    parser.add_argument("--flush-every", type=int, default=20,
+                        help="Write the painting index and checkpoint every this many batches")
+    parser.add_argument("--centroids-per-artist", type=int, default=1,
+                        help="k-means centroids per artist in the artist index (more than 1 needs RETRIEVAL_MODE=two_stage)")
+    args = parser.parse_args()
+
+    if args.level in ("painting", "both") and not args.paintings_index:
+        parser.error("--paintings-index (or PAINTINGS_INDEX) is required for painting-level vectors")
+
+    ingest(args.root, args.artists_csv, args.state, level=args.level, artists_index=args.artists_index,
+           paintings_index=args.paintings_index, store_kind=args.store, batch_size=args.batch_size,
+           workers=args.workers, upsert_chunk=args.upsert_chunk, centroids_per_artist=args.centroids_per_artist,
+           flush_every=args.flush_every)
+
+
+if __name__ == "__main__":
+    main()
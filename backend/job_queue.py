@@ -0,0 +1,193 @@
+from dotenv import load_dotenv
+import asyncio
+from collections import deque
+import itertools
+import logging
+import os
+import time
+import uuid
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Config ---
+# Only "local" (in-process asyncio workers) is implemented
+JOB_BACKEND = os.getenv("JOB_BACKEND", "local")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "64"))
+# Finished jobs (and their results) are kept this long for polling
+JOB_TTL = float(os.getenv("JOB_TTL", "900"))
+# ...but at most this many, oldest evicted first (results can hold image bytes)
+JOB_MAX_FINISHED = int(os.getenv("JOB_MAX_FINISHED", "256"))
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 9
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, kind, priority):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.priority = priority
+        self.status = "queued"
+        self.stage = "queued"
+        self.events = []
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._changed = asyncio.Event()
+        self._add_event("queued")
+
+    def _add_event(self, stage, **info):
+        self.events.append({"stage": stage, "status": self.status, "time": round(time.time() - self.created_at, 3), **info})
+        # Wake every waiting subscriber, then re-arm for the next event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def progress(self, stage, **info):
+        """
+        Record that the job reached a pipeline stage; streamed to subscribers.
+        """
+        self.stage = stage
+        self._add_event(stage, **info)
+
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    async def subscribe(self):
+        """
+        Yield every event of the job, past and future, until it finishes.
+        """
+        sent = 0
+        while True:
+            changed = self._changed
+            while sent < len(self.events):
+                yield self.events[sent]
+                sent += 1
+            if self.finished():
+                return
+            await changed.wait()
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.stage,
+            "priority": self.priority,
+            "error": self.error,
+            "events": self.events,
+        }
+
+
+class LocalJobQueue:
+    """
+    In-process job queue: a bounded priority queue drained by a fixed number of
+    asyncio workers. submit() raises QueueFull once max_queued jobs are waiting, so
+    callers can answer 429 instead of piling up work.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, max_queued=JOB_MAX_QUEUED, ttl=JOB_TTL,
+                 max_finished=JOB_MAX_FINISHED):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self.max_finished = max_finished
+        self.jobs = {}
+        # Finished job ids, oldest first
+        self._finished = deque()
+        self._queue = None
+        self._tasks = []
+        self._sequence = itertools.count()
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.ensure_future(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, kind, run, priority=PRIORITY_NORMAL):
+        """
+        Queue run(job), a coroutine function whose return value becomes job.result.
+        """
+        self.start()
+        self._purge()
+        if self._queue.qsize() >= self.max_queued:
+            raise QueueFull(f"{self._queue.qsize()} jobs already queued")
+        job = Job(kind, priority)
+        self.jobs[job.id] = job
+        self._queue.put_nowait((priority, next(self._sequence), job, run))
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def stats(self):
+        running = sum(1 for j in self.jobs.values() if j.status == "running")
+        return {
+            "backend": "local",
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue else 0,
+            "running": running,
+            "max_queued": self.max_queued,
+            "tracked_jobs": len(self.jobs),
+            "max_finished": self.max_finished,
+        }
+
+    def _purge(self):
+        cutoff = time.time() - self.ttl
+        while self._finished and (len(self._finished) > self.max_finished
+                                  or self.jobs[self._finished[0]].finished_at < cutoff):
+            del self.jobs[self._finished.popleft()]
+
+    async def _worker(self, number):
+        while True:
+            _, _, job, run = await self._queue.get()
+            job.status = "running"
+            job.progress("started", worker=number)
+            try:
+                job.result = await run(job)
+                job.status = "done"
+                job.finished_at = time.time()
+                job.progress("done")
+            except asyncio.CancelledError:
+                job.status = "failed"
+                job.error = "Cancelled"
+                job.finished_at = time.time()
+                job.progress("failed", detail=job.error)
+                raise
+            except Exception as e:
+                logger.error(f"Job {job.id} ({job.kind}) failed: {str(e)}", exc_info=True)
+                job.status = "failed"
+                job.error = getattr(e, "detail", None) or str(e)
+                job.finished_at = time.time()
+                job.progress("failed", detail=job.error)
+            finally:
+                self._finished.append(job.id)
+                self._purge()
+                self._queue.task_done()
+
+
+_queue = None
+
+
+def get_job_queue():
+    global _queue
+    if _queue is None:
+        if JOB_BACKEND != "local":
+            raise ValueError(f"Unknown JOB_BACKEND: {JOB_BACKEND}")
+        _queue = LocalJobQueue()
+    return _queue
@@ -0,0 +1,174 @@
+from dotenv import load_dotenv
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from metrics import Counter, register
+
+load_dotenv()
+
+# --- Config ---
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Empty LOG_FILE logs to stderr only
+LOG_FILE = os.getenv("LOG_FILE", "backend.log")
+# "json" (one object per line) or "text"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(20 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+# Records waiting for the writer thread; beyond this they are dropped, never blocking
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Fraction of DEBUG records kept, and at most this many per second from any one call site
+LOG_DEBUG_SAMPLE = float(os.getenv("LOG_DEBUG_SAMPLE", "1.0"))
+LOG_DEBUG_RATE = float(os.getenv("LOG_DEBUG_RATE", "10"))
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# LogRecord attributes that are not user-supplied `extra` fields
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+DROPPED_RECORDS = register(Counter(
+    "trumuse_log_records_dropped_total", "Log records dropped because the log queue was full"
+))
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record; fields passed with extra={...} are included.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class DebugSampler(logging.Filter):
+    """
+    Keeps `sample` of DEBUG records, then at most `rate` per second per call site
+    (token bucket). Records at INFO and above always pass.
+    """
+
+    def __init__(self, sample=LOG_DEBUG_SAMPLE, rate=LOG_DEBUG_RATE):
+        super().__init__()
+        self.sample = sample
+        self.rate = rate
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        if self.sample < 1.0 and random.random() >= self.sample:
+            return False
+        if self.rate <= 0:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.rate, now))
+            tokens = min(self.rate, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return False
+            self._buckets[key] = (tokens - 1, now)
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler over a bounded queue that drops records instead of blocking the
+    caller when the writer falls behind.
+    """
+
+    def prepare(self, record):
+        # Only merge args into the message here; tracebacks and the formatter run
+        # on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED_RECORDS.inc()
+
+
+_listener = None
+_queue_handler = None
+
+
+def configure_logging(level=LOG_LEVEL, filename=LOG_FILE, fmt=LOG_FORMAT):
+    """
+    Route every logger through a queue: the calling thread only filters and enqueues,
+    and a background listener formats and writes to a rotating file (or stderr).
+    Safe to call more than once.
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return _queue_handler
+
+    formatter = JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT)
+    if filename:
+        output = RotatingFileHandler(filename, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+                                     encoding="utf-8")
+    else:
+        output = logging.StreamHandler()
+    output.setFormatter(formatter)
+
+    _queue_handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    _queue_handler.addFilter(DebugSampler())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(_queue_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _queue_handler
+
+
+def stop_logging():
+    """
+    Flush queued records and stop the writer thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+
+def _reset_after_fork():
+    # The writer thread does not survive a fork, and its queue may have been locked
+    # mid-put; a forked child detaches from both and calls configure_logging() again
+    global _listener, _queue_handler
+    if _queue_handler is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+    _listener = None
+    _queue_handler = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
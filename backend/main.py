@@ -1,29 +1,37 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import StreamingResponse, RedirectResponse, JSONResponse
-from generate_report import generate_attribution_report
-from hana_utils import get_artist_metadata
-from vector_utils import get_clip_embedding, query_similar_vectors, clip_model, preprocess
-from claude_utils import summarize_wikipedia_url
-from PIL import Image as PILImage
-import torch
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Request
+from typing import List, Optional
+from fastapi.responses import StreamingResponse, RedirectResponse, JSONResponse, PlainTextResponse
+from generate_report import render_report, ReportQueueFull, get_report_executor, shutdown_report_executor, report_queue_depth
+from metadata_cache import get_artists_metadata, get_metadata_cache, METADATA_PRELOAD
+from vector_utils import query_similar_vectors, get_clip_model
+from enrichment import enrich_artists, frontend_rows
+from summary_cache import get_summary_cache
+from result_store import get_result_store
+from image_io import decode_image, CLIP_DECODE_SIZE
+from job_queue import get_job_queue, QueueFull, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from batch_attribution import stream_batch, expand_archive, BatchError, BATCH_MAX_IMAGES, BATCH_MAX_ARCHIVE_BYTES
+from embedding_cache import get_embedding_cache, content_hash, perceptual_hash
+from patch_cache import get_patch_cache
+from metrics import span, start_request_timings, server_timing_header, render_prometheus, SamplingProfiler, REQUEST_SECONDS
 from dotenv import load_dotenv
 import io
 import os
 import logging
-import uuid
+import base64
 import json
+import time
+import zipfile
 import heatmap_generator
-import logging
+from log_config import configure_logging, stop_logging
+import model_registry
+import resilience
+from embedding_service import get_embedding_service
+from starlette.concurrency import run_in_threadpool
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 
-# Set up logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    filename="backend.log",
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    filemode="a"
-)
+# Set up logging: records are queued and written to a rotating file off the request path
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Load environment variables
@@ -34,6 +42,9 @@ app = FastAPI()
 # Mount the frontend folder as a static directory
 app.mount("/frontend", StaticFiles(directory="../frontend"), name="frontend")
 
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024  # 10MB limit
+MAX_COMPARISONS = int(os.getenv("HEATMAP_MAX_COMPARISONS", "20"))
+
 allowed_origins = os.getenv("ALLOWED_ORIGINS", "http://localhost:3000").split(",")
 
 app.add_middleware(
@@ -42,116 +53,183 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Result-Id", "Server-Timing"],
 )
 
-def process_image_and_generate_report(image_path):
+profiler = SamplingProfiler()
+
+@app.middleware("http")
+async def record_timings(request: Request, call_next):
+    """
+    Request latency histogram, a Server-Timing header with the stages this request
+    went through, and (when PROFILE_EVERY_N is set) a sampled profile dump.
+    """
+    timings = start_request_timings()
+    sampled = profiler.start() if profiler.should_sample() else None
+    start = time.perf_counter()
+    status = 500
     try:
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        logger.debug(f"Using device: {device}")
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - start
+        route = request.scope.get("route")
+        REQUEST_SECONDS.observe(elapsed, method=request.method,
+                                route=getattr(route, "path", "unmatched"), status=status)
+        if sampled is not None:
+            profiler.stop(sampled, request.url.path)
+    response.headers["Server-Timing"] = server_timing_header(timings + [("total", elapsed)])
+    return response
+
+@app.on_event("startup")
+async def start_background_workers():
+    # Load CLIP once per worker, ahead of the first request
+    if model_registry.CLIP_WARMUP != "off":
+        model_registry.warm_up(background=model_registry.CLIP_WARMUP == "background")
+    get_embedding_service().start()
+    # Start the PDF worker processes now rather than on the first upload
+    get_report_executor()
+    get_job_queue().start()
+    get_result_store().start_purge()
+    # Keep artist metadata in memory so requests don't query HANA
+    if METADATA_PRELOAD != "off":
+        get_metadata_cache().start_refresh()
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    get_embedding_service().stop(timeout=5)
+    get_metadata_cache().stop_refresh()
+    get_result_store().stop_purge()
+    shutdown_report_executor()
+    await get_job_queue().stop()
+    stop_logging()
+
+def decode_upload(image_bytes):
+    img = decode_image(image_bytes, min_size=CLIP_DECODE_SIZE)
+    return img, perceptual_hash(img)
+
+async def read_upload(upload):
+    """
+    The upload's bytes, reading at most MAX_UPLOAD_BYTES + 1 so an oversized file
+    is rejected without being buffered whole.
+    """
+    data = await upload.read(MAX_UPLOAD_BYTES + 1)
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=400, detail="File size exceeds 10MB")
+    return data
+
+def preprocess_image(img):
+    _, preprocess = get_clip_model()
+    return preprocess(img)
+
+def report_progress(progress, stage, **info):
+    if progress is not None:
+        progress(stage, **info)
 
-        # Validate image file
-        if not os.path.exists(image_path):
-            logger.error(f"Image file not found: {image_path}")
-            raise HTTPException(status_code=400, detail="Image file not found on server")
+async def find_similar_artists(image_bytes, top_k=5, progress=None):
+    """
+    Top-k (artist_id, score) matches for an uploaded image, served from the
+    embedding cache for repeat and near-duplicate uploads.
+    """
+    cache = get_embedding_cache()
+    sha256 = content_hash(image_bytes)
+    cached = cache.get_exact(sha256)
+
+    if cached is None:
+        # Decode straight from the upload bytes
+        report_progress(progress, "decode")
         try:
-            with PILImage.open(image_path) as img:
-                input_image = preprocess(img).unsqueeze(0).to(device)
+            with span("decode"):
+                img, image_hash = await run_in_threadpool(decode_upload, image_bytes)
         except Exception as e:
-            logger.error(f"Invalid image format for {image_path}: {str(e)}", exc_info=True)
+            logger.error(f"Invalid image format: {str(e)}", exc_info=True)
             raise HTTPException(status_code=400, detail=f"Invalid image format: {str(e)}")
+        cached = cache.get_near(sha256, image_hash)
+
+    if cached is not None and top_k in cached["matches"]:
+        logger.debug("Serving similar artists from the embedding cache")
+        report_progress(progress, "cache_hit")
+        return cached["matches"][top_k]
 
-        # Get CLIP embedding
+    if cached is not None:
+        image_vector = cached["embedding"]
+    else:
+        # Get CLIP embedding (batched with other in-flight requests)
+        report_progress(progress, "embed")
         try:
-            image_vector = get_clip_embedding(clip_model, input_image)
+            with span("embed"):
+                input_image = await run_in_threadpool(preprocess_image, img)
+                image_vector = await get_embedding_service().embed(input_image)
             logger.debug("Successfully generated CLIP embedding")
         except Exception as e:
             logger.error(f"CLIP embedding failure: {str(e)}", exc_info=True)
             raise HTTPException(status_code=500, detail=f"CLIP embedding error: {str(e)}")
 
-        # Query similar vectors from Pinecone
-        try:
-            similar_artists = query_similar_vectors(image_vector, top_k=5)
-            logger.debug(f"Found {len(similar_artists)} similar artists")
-        except Exception as e:
-            logger.error(f"Pinecone query failed: {str(e)}", exc_info=True)
-            raise HTTPException(status_code=500, detail=f"Pinecone query error: {str(e)}")
+    # Query similar vectors from Pinecone
+    report_progress(progress, "query")
+    try:
+        with span("query"):
+            similar_artists = await run_in_threadpool(query_similar_vectors, image_vector, top_k)
+        logger.debug("Found %d similar artists", len(similar_artists))
+    except (resilience.CircuitOpen, resilience.DeadlineExceeded) as e:
+        logger.error(f"Artist index unavailable: {str(e)}")
+        raise HTTPException(status_code=503, detail="Artist index unavailable, please retry shortly")
+    except Exception as e:
+        logger.error(f"Pinecone query failed: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Pinecone query error: {str(e)}")
+
+    if cached is not None:
+        cache.set_matches(cached, top_k, similar_artists)
+    else:
+        cache.put(sha256, image_hash, image_vector, {top_k: similar_artists})
+    return similar_artists
+
+async def process_image_and_generate_report(image_bytes, progress=None):
+    try:
+        # One deadline shared by the vector, metadata and summary calls below
+        with resilience.request_budget():
+            device = model_registry.default_device()
+            logger.debug("Using device: %s", device)
+
+            similar_artists = await find_similar_artists(image_bytes, top_k=5, progress=progress)
 
-        # Fetch metadata and generate bio summaries
-        artist_infos = []
-        bio_summaries = {}
-        for artist_id, score in similar_artists:
+            # Fetch metadata for all matches in one round-trip
+            report_progress(progress, "metadata")
             try:
-                logger.debug(f"Processing artist_id: {artist_id}")
-                metadata = get_artist_metadata(artist_id)
-                if not metadata:
-                    logger.warning(f"No metadata for artist_id: {artist_id}")
-                    continue
-                wikipedia_url = metadata.get("wikipedia")
-                bio = "(No Wikipedia summary available)"
-                if wikipedia_url:
-                    try:
-                        bio = summarize_wikipedia_url(wikipedia_url)
-                        logger.debug(f"Successfully summarized Wikipedia for {artist_id}")
-                    except Exception as e:
-                        logger.error(f"Wikipedia summary failed for {artist_id}: {str(e)}")
-                bio_summaries[metadata.get("name", f"Artist_{artist_id}")] = bio
-                artist_infos.append({"artist_id": artist_id, "score": score, "metadata": metadata})
+                with span("metadata"):
+                    metadata_by_id = await run_in_threadpool(get_artists_metadata, [a for a, _ in similar_artists])
             except Exception as e:
-                logger.error(f"Failed to process artist {artist_id}: {str(e)}", exc_info=True)
-                continue
-
-        if not artist_infos:
-            logger.error("No valid artist data retrieved")
-            raise HTTPException(status_code=500, detail="No valid artist data retrieved")
-
-        # Generate JSON for frontend
-        html_friendly_data = []
-        for info in artist_infos:
-            metadata = info["metadata"]
-            html_friendly_data.append({
-                "id": str(metadata.get("id", "Unknown")),
-                "name": str(metadata.get("name", "Unknown")),
-                "years": str(metadata.get("years", "Unknown")),
-                "genre": str(metadata.get("genre", "Unknown")),
-                "nationality": str(metadata.get("nationality", "Unknown")),
-                "similarity_score": float(round(info["score"] * 100, 2)),
-                "bio": str(bio_summaries.get(metadata.get("name", f"Artist_{info['artist_id']}"), "(No bio)"))
-            })
-
-        # Save to JSON
-        BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-        JSON_PATH = os.path.join(BASE_DIR, "..", "frontend", "public", "matched_artists.json")
-        try:
-            os.makedirs(os.path.dirname(JSON_PATH), exist_ok=True)
-            with open(JSON_PATH, "w", encoding="utf-8") as f:
-                json.dump(html_friendly_data, f)
-            logger.debug(f"Successfully wrote JSON to {JSON_PATH}")
-        except Exception as e:
-            logger.error(f"Failed to write JSON to {JSON_PATH}: {str(e)}", exc_info=True)
-            raise HTTPException(status_code=500, detail=f"Failed to write JSON: {str(e)}")
+                logger.error(f"Metadata fetch failed: {str(e)}", exc_info=True)
+                metadata_by_id = {}
 
-        # Generate and save PDF
-        pdf_buffer = io.BytesIO()
-        try:
-            generate_attribution_report(image_path, pdf_buffer, artist_infos, bio_summaries)
-            logger.debug("Successfully generated PDF buffer")
-        except Exception as e:
-            logger.error(f"PDF generation failed: {str(e)}", exc_info=True)
-            raise HTTPException(status_code=500, detail=f"PDF generation error: {str(e)}")
+            # Generate bio summaries for all matches concurrently
+            report_progress(progress, "summaries")
+            with span("summaries"):
+                artist_infos, bio_summaries = await enrich_artists(similar_artists, metadata_by_id)
 
-        pdf_buffer.seek(0)
-        PDF_PATH = os.path.join(BASE_DIR, "..", "frontend", "public", "attribution_report.pdf")
-        try:
-            os.makedirs(os.path.dirname(PDF_PATH), exist_ok=True)
-            with open(PDF_PATH, "wb") as f:
-                f.write(pdf_buffer.read())
-            logger.debug(f"Successfully wrote PDF to {PDF_PATH}")
-        except Exception as e:
-            logger.error(f"Failed to write PDF to {PDF_PATH}: {str(e)}", exc_info=True)
-            raise HTTPException(status_code=500, detail=f"Failed to write PDF: {str(e)}")
+            if not artist_infos:
+                logger.error("No valid artist data retrieved")
+                raise HTTPException(status_code=500, detail="No valid artist data retrieved")
+
+            # Generate JSON for frontend
+            html_friendly_data = frontend_rows(artist_infos, bio_summaries)
+
+            # Generate PDF in the report worker pool
+            report_progress(progress, "report")
+            try:
+                with span("report"):
+                    pdf_buffer = io.BytesIO(await render_report(artist_infos, bio_summaries))
+                logger.debug("Successfully generated PDF buffer")
+            except ReportQueueFull as e:
+                logger.warning(f"Report queue full: {str(e)}")
+                raise HTTPException(status_code=503, detail="Server busy, please retry shortly")
+            except Exception as e:
+                logger.error(f"PDF generation failed: {str(e)}", exc_info=True)
+                raise HTTPException(status_code=500, detail=f"PDF generation error: {str(e)}")
 
-        pdf_buffer.seek(0)
-        return pdf_buffer, html_friendly_data
+            return pdf_buffer, html_friendly_data
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Unexpected error in process_image_and_generate_report: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
@@ -163,94 +241,168 @@ async def redirect_to_artist_upload():
 @app.post("/upload_and_download")
 async def upload_and_download(image: UploadFile = File(...)):
     try:
-        print(f"Received file: {image.filename}, content_type: {image.content_type}, size: {image.size}")
-        logger.info(f"Received file: {image.filename}, content_type: {image.content_type}, size: {image.size}")
+        logger.info("Received file %s", image.filename,
+                    extra={"content_type": image.content_type, "size": image.size})
 
         # Validate file type and size
         if not image.content_type.startswith('image/'):
             logger.error(f"Invalid file type: {image.content_type}")
             raise HTTPException(status_code=400, detail="File must be an image")
-        if image.size > 10 * 1024 * 1024:  # 10MB limit
+        if image.size > MAX_UPLOAD_BYTES:
             logger.error(f"File too large: {image.size} bytes")
             raise HTTPException(status_code=400, detail="File size exceeds 10MB")
 
-        # Use unique temporary file name
-        unique_id = str(uuid.uuid4())
-        image_path = f"temp_{unique_id}_{image.filename}"
         try:
-            with open(image_path, "wb") as buffer:
-                buffer.write(await image.read())
-            logger.debug(f"Successfully saved temporary image to {image_path}")
+            image_bytes = await image.read()
         except Exception as e:
-            logger.error(f"Failed to save uploaded image {image_path}: {str(e)}", exc_info=True)
-            raise HTTPException(status_code=500, detail=f"Failed to save image: {str(e)}")
+            logger.error(f"Failed to read uploaded image {image.filename}: {str(e)}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"Failed to read image: {str(e)}")
 
-        try:
-            pdf_buffer, _ = process_image_and_generate_report(image_path)
-        except HTTPException as e:
-            if os.path.exists(image_path):
-                os.remove(image_path)
-            raise e
-        except Exception as e:
-            logger.error(f"Error processing image: {str(e)}", exc_info=True)
-            if os.path.exists(image_path):
-                os.remove(image_path)
-            raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
+        pdf_buffer, html_friendly_data = await process_image_and_generate_report(image_bytes)
 
-        if os.path.exists(image_path):
-            try:
-                os.remove(image_path)
-                logger.debug(f"Successfully deleted temporary image {image_path}")
-            except Exception as e:
-                logger.warning(f"Failed to delete temp image {image_path}: {str(e)}")
+        # Keep this request's results under their own id for the report pages (written
+        # through to disk, so whichever worker serves the report pages can read them)
+        result_id = await run_in_threadpool(get_result_store().put, html_friendly_data, pdf_buffer.getvalue())
 
         return StreamingResponse(
             pdf_buffer,
             media_type="application/pdf",
-            headers={"Content-Disposition": "attachment; filename=Attribution_Report.pdf"}
+            headers={
+                "Content-Disposition": "attachment; filename=Attribution_Report.pdf",
+                "X-Result-Id": result_id
+            }
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in upload_and_download: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
 
-@app.get("/get_attribution_data")
-async def get_attribution_data():
+@app.post("/batch_attribution")
+async def batch_attribution(
+    images: Optional[List[UploadFile]] = File(None),
+    archive: Optional[UploadFile] = File(None),
+    report: bool = Form(False),
+    top_k: int = Form(5)
+):
+    """
+    Score a set of images (multipart files and/or a zip archive) in one request.
+    Streams one NDJSON line per image as it completes, then a summary line.
+    """
+    if not 1 <= top_k <= 50:
+        raise HTTPException(status_code=400, detail="top_k must be between 1 and 50")
+    items = []
+    total = 0
     try:
-        BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-        JSON_PATH = os.path.join(BASE_DIR, "..", "frontend", "public", "matched_artists.json")
-        if not os.path.exists(JSON_PATH):
-            logger.error(f"Attribution data not found at {JSON_PATH}")
-            raise HTTPException(status_code=404, detail="Attribution data not found. Please upload an image first.")
-        with open(JSON_PATH, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        logger.debug("Successfully fetched attribution data")
-        return JSONResponse(content=data)
-    except Exception as e:
-        logger.error(f"Error fetching attribution data: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Error fetching data: {str(e)}")
+        # Parts are spooled to temporary files by the form parser; check the count and
+        # sizes before reading any of them into memory
+        if len(images or []) > BATCH_MAX_IMAGES:
+            raise BatchError(f"At most {BATCH_MAX_IMAGES} images per batch")
+        for upload in images or []:
+            if upload.size is not None and upload.size > MAX_UPLOAD_BYTES:
+                raise BatchError(f"{upload.filename} exceeds 10MB")
+            total += upload.size or 0
+            if total > BATCH_MAX_ARCHIVE_BYTES:
+                raise BatchError(f"Batch exceeds {BATCH_MAX_ARCHIVE_BYTES} bytes")
+        if archive is not None and total + (archive.size or 0) > BATCH_MAX_ARCHIVE_BYTES:
+            raise BatchError(f"Batch exceeds {BATCH_MAX_ARCHIVE_BYTES} bytes")
+
+        for upload in images or []:
+            data = await upload.read(MAX_UPLOAD_BYTES + 1)
+            if len(data) > MAX_UPLOAD_BYTES:
+                raise BatchError(f"{upload.filename} exceeds 10MB")
+            items.append((upload.filename, data))
+        if archive is not None:
+            items.extend(expand_archive(await archive.read(BATCH_MAX_ARCHIVE_BYTES + 1), MAX_UPLOAD_BYTES))
+    except (BatchError, zipfile.BadZipFile) as e:
+        logger.error(f"Rejected batch upload: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not items:
+        raise HTTPException(status_code=400, detail="No images in request")
+    if len(items) > BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_IMAGES} images per batch")
+    logger.info("Batch attribution for %d images", len(items))
+
+    async def ndjson():
+        async for line in stream_batch(items, top_k=top_k, report=report):
+            yield json.dumps(line) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+@app.get("/get_attribution_data/{result_id}")
+async def get_attribution_data(result_id: str):
+    result = await run_in_threadpool(get_result_store().get, result_id)
+    if result is None:
+        logger.error(f"Attribution data not found for result {result_id}")
+        raise HTTPException(status_code=404, detail="Attribution data not found. Please upload an image first.")
+    logger.debug("Successfully fetched attribution data for result %s", result_id)
+    return JSONResponse(content=result["data"])
+
+@app.get("/attribution_report/{result_id}")
+async def get_attribution_report(result_id: str):
+    result = await run_in_threadpool(get_result_store().get, result_id)
+    if result is None or result["pdf"] is None:
+        logger.error(f"Attribution report not found for result {result_id}")
+        raise HTTPException(status_code=404, detail="Attribution report not found. Please upload an image first.")
+    return StreamingResponse(
+        io.BytesIO(result["pdf"]),
+        media_type="application/pdf",
+        headers={"Content-Disposition": "attachment; filename=Attribution_Report.pdf"}
+    )
+
+@app.get("/model_status")
+async def model_status():
+    return JSONResponse(content={
+        "loaded": model_registry.is_loaded(),
+        **model_registry.stats(),
+        "embedding_batches": get_embedding_service().stats(),
+        "report_queue_depth": report_queue_depth(),
+        "circuit_breakers": resilience.stats()
+    })
+
+@app.get("/healthz")
+async def healthz():
+    # Liveness: the worker's event loop is answering
+    return JSONResponse(content={"status": "ok", "pid": os.getpid()})
+
+@app.get("/readyz")
+async def readyz():
+    # Readiness: only once CLIP is loaded and has run a forward pass in this worker
+    ready = model_registry.CLIP_WARMUP == "off" or model_registry.is_warm()
+    return JSONResponse(status_code=200 if ready else 503, content={
+        "ready": ready,
+        "pid": os.getpid(),
+        "model_loaded": model_registry.is_loaded()
+    })
+
+@app.get("/cache_stats")
+async def cache_stats():
+    return JSONResponse(content={
+        "artist_metadata": get_metadata_cache().stats(),
+        "bio_summaries": get_summary_cache().stats(),
+        "results": get_result_store().stats(),
+        "image_embeddings": get_embedding_cache().stats(),
+        "heatmap_patch_grids": get_patch_cache().stats()
+    })
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus scrape endpoint
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
 
 @app.post("/compare_artworks")
 async def compare_artworks(original_image: UploadFile = File(...), ai_image: UploadFile = File(...)):
     try:
-        # Save both images temporarily
-        original_path = f"temp_original_{original_image.filename}"
-        ai_path = f"temp_ai_{ai_image.filename}"
-        with open(original_path, "wb") as buffer:
-            buffer.write(await original_image.read())
-        with open(ai_path, "wb") as buffer:
-            buffer.write(await ai_image.read())
+        # Decode both uploads in memory, no temp files
+        original_bytes = await read_upload(original_image)
+        ai_bytes = await read_upload(ai_image)
 
         # Generate heatmap comparing the two images
         heatmap_buffer = io.BytesIO()
-        heatmap_generator.generate_heatmap(original_path, ai_path, heatmap_buffer)
+        await run_in_threadpool(heatmap_generator.generate_heatmap, original_bytes, ai_bytes, heatmap_buffer)
         heatmap_buffer.seek(0)
 
-        # Clean up temporary files
-        if os.path.exists(original_path):
-            os.remove(original_path)
-        if os.path.exists(ai_path):
-            os.remove(ai_path)
-
         return StreamingResponse(
             heatmap_buffer,
             media_type="image/jpeg",
@@ -260,6 +412,123 @@ async def compare_artworks(original_image: UploadFile = File(...), ai_image: Upl
         logger.error(f"Error comparing artworks: {str(e)}", exc_info=True)
         raise
 
+@app.post("/compare_artworks_many")
+async def compare_artworks_many(original_image: UploadFile = File(...), ai_images: List[UploadFile] = File(...)):
+    """
+    Heatmaps of one original against several AI images. The original's patch grid
+    is embedded once and the AI images in a single batch.
+    """
+    if len(ai_images) > MAX_COMPARISONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_COMPARISONS} AI images per request")
+    try:
+        original_bytes = await read_upload(original_image)
+        ai_bytes = [await read_upload(upload) for upload in ai_images]
+
+        heatmaps = await run_in_threadpool(heatmap_generator.generate_heatmaps, original_bytes, ai_bytes)
+        return JSONResponse(content={"heatmaps": [
+            {
+                "filename": upload.filename,
+                "media_type": "image/jpeg",
+                "image": base64.b64encode(heatmap).decode("ascii")
+            }
+            for upload, heatmap in zip(ai_images, heatmaps)
+        ]})
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error comparing artworks: {str(e)}", exc_info=True)
+        raise
+
+# --- Background jobs: submit, follow progress, fetch the result ---
+
+def submit_job(kind, run, priority):
+    try:
+        job = get_job_queue().submit(kind, run, priority=max(PRIORITY_HIGH, min(PRIORITY_LOW, priority)))
+    except QueueFull as e:
+        logger.warning(f"Rejected {kind} job: {str(e)}")
+        raise HTTPException(status_code=429, detail="Too many queued jobs, please retry shortly")
+    return JSONResponse(status_code=202, content={
+        "job_id": job.id,
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events",
+        "result_url": f"/jobs/{job.id}/result"
+    })
+
+@app.post("/jobs/attribution")
+async def submit_attribution_job(image: UploadFile = File(...), priority: int = Form(PRIORITY_NORMAL)):
+    if not image.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="File must be an image")
+    image_bytes = await read_upload(image)
+
+    async def run(job):
+        pdf_buffer, html_friendly_data = await process_image_and_generate_report(image_bytes, progress=job.progress)
+        result_id = await run_in_threadpool(get_result_store().put, html_friendly_data, pdf_buffer.getvalue())
+        return {"result_id": result_id, "artists": html_friendly_data}
+
+    return submit_job("attribution", run, priority)
+
+@app.post("/jobs/compare_artworks")
+async def submit_compare_job(original_image: UploadFile = File(...), ai_image: UploadFile = File(...),
+                             priority: int = Form(PRIORITY_NORMAL)):
+    original_bytes = await read_upload(original_image)
+    ai_bytes = await read_upload(ai_image)
+
+    async def run(job):
+        job.progress("heatmap")
+        heatmap_buffer = io.BytesIO()
+        await run_in_threadpool(heatmap_generator.generate_heatmap, original_bytes, ai_bytes, heatmap_buffer)
+        return {"heatmap": heatmap_buffer.getvalue()}
+
+    return submit_job("compare_artworks", run, priority)
+
+def get_job_or_404(job_id):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    job = get_job_or_404(job_id)
+    status = job.to_dict()
+    if job.status == "done" and job.kind == "attribution":
+        status["result_id"] = job.result["result_id"]
+    return JSONResponse(content=status)
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    job = get_job_or_404(job_id)
+
+    async def sse():
+        async for event in job.subscribe():
+            yield f"event: progress\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(sse(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = get_job_or_404(job_id)
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=f"Job failed: {job.error}")
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job.status} ({job.stage})")
+    if job.kind == "compare_artworks":
+        return StreamingResponse(
+            io.BytesIO(job.result["heatmap"]),
+            media_type="image/jpeg",
+            headers={"Content-Disposition": "inline; filename=heatmap.jpg"}
+        )
+    return JSONResponse(content=job.result)
+
+@app.get("/jobs")
+async def job_queue_stats():
+    return JSONResponse(content=get_job_queue().stats())
+
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
+    # Development server; run serve.py in production. Hand over to the uvicorn CLI
+    # rather than serving from this process: spawned report workers re-import
+    # __main__, which here would be this module with torch, CLIP and the whole app
+    # (and reload needs the app as an import string anyway)
+    import sys
+    os.execv(sys.executable, [sys.executable, "-m", "uvicorn", "main:app",
+                              "--host", "127.0.0.1", "--port", "8000", "--reload"])
\ No newline at end of file
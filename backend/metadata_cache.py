@@ -0,0 +1,211 @@
+from collections import OrderedDict
+from dotenv import load_dotenv
+import logging
+import os
+import threading
+import time
+import hana_utils
+import resilience
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Config ---
+METADATA_CACHE_SIZE = int(os.getenv("METADATA_CACHE_SIZE", "1024"))
+METADATA_CACHE_TTL = float(os.getenv("METADATA_CACHE_TTL", "3600"))
+METADATA_REFRESH_INTERVAL = float(os.getenv("METADATA_REFRESH_INTERVAL", "900"))
+# "auto" tries HANA and falls back to artists.csv, or pick "hana", "csv" or "off"
+METADATA_PRELOAD = os.getenv("METADATA_PRELOAD", "auto")
+# Deadline for one bulk HANA lookup, and when to send a hedged second query (0 = never)
+METADATA_TIMEOUT = float(os.getenv("METADATA_TIMEOUT", "3"))
+METADATA_HEDGE_AFTER = float(os.getenv("METADATA_HEDGE_AFTER", "0"))
+ARTISTS_CSV_PATH = os.getenv(
+    "ARTISTS_CSV_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "artists.csv")
+)
+
+
+class MetadataCache:
+    """
+    Bounded LRU + TTL cache of artist metadata in front of hana_utils.
+
+    Lookups for ids not in the cache (or expired) are fetched in a single bulk query.
+    preload() fills the cache from HANA or artists.csv, and start_refresh() keeps it
+    fresh in the background so steady-state requests never hit the database.
+    """
+
+    def __init__(self, max_size=METADATA_CACHE_SIZE, ttl=METADATA_CACHE_TTL,
+                 loader=None, load_all=None, csv_path=ARTISTS_CSV_PATH):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.csv_path = csv_path
+        # Looked up at call time so hana_utils.set_pool() and monkeypatching still apply
+        self._loader = loader or self._fetch
+        self._load_all = load_all or (lambda: hana_utils.get_all_artists_metadata())
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+        self._stop_refresh = threading.Event()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.last_refresh = None
+        self.source = None
+        self._csv_artists = None
+
+    def _put(self, artist_id, metadata, now):
+        self._entries[artist_id] = (metadata, now + self.ttl)
+        self._entries.move_to_end(artist_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _fetch(self, artist_ids):
+        # HANA behind a deadline and circuit breaker; artists.csv when HANA is failing
+        return resilience.call(
+            "metadata", hana_utils.get_artists_metadata, artist_ids,
+            timeout=METADATA_TIMEOUT, hedge_after=METADATA_HEDGE_AFTER or None,
+            fallback=lambda: self._csv_fallback(artist_ids)
+        )
+
+    def _csv_fallback(self, artist_ids):
+        if self._csv_artists is None:
+            try:
+                self._csv_artists = hana_utils.load_artists_csv(self.csv_path)
+            except OSError as e:
+                logger.error(f"No CSV metadata fallback: {str(e)}")
+                self._csv_artists = {}
+        return {int(i): self._csv_artists[int(i)] for i in artist_ids if int(i) in self._csv_artists}
+
+    def get_many(self, artist_ids) -> dict:
+        """
+        {artist_id: metadata} for every id that exists; misses are fetched in one query.
+        """
+        ids = list(dict.fromkeys(int(i) for i in artist_ids))
+        found = {}
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            for artist_id in ids:
+                entry = self._entries.get(artist_id)
+                if entry is not None and entry[1] > now:
+                    self._entries.move_to_end(artist_id)
+                    found[artist_id] = entry[0]
+                    self.hits += 1
+                else:
+                    if entry is not None:
+                        del self._entries[artist_id]
+                    missing.append(artist_id)
+                    self.misses += 1
+
+        if missing:
+            fetched = self._loader(missing)
+            now = time.monotonic()
+            with self._lock:
+                for artist_id, metadata in fetched.items():
+                    self._put(int(artist_id), metadata, now)
+            found.update({int(k): v for k, v in fetched.items()})
+
+        return {artist_id: found[artist_id] for artist_id in ids if artist_id in found}
+
+    def get(self, artist_id) -> dict:
+        artist_id = int(artist_id)
+        return self.get_many([artist_id]).get(artist_id, {})
+
+    def load(self, artists, source):
+        now = time.monotonic()
+        with self._lock:
+            for artist_id, metadata in artists.items():
+                self._put(int(artist_id), metadata, now)
+        self.last_refresh = time.time()
+        self.source = source
+        return len(artists)
+
+    def preload(self, source=METADATA_PRELOAD) -> int:
+        """
+        Fill the cache with every artist. Returns the number of artists loaded.
+        """
+        if source == "off":
+            return 0
+        if source in ("auto", "hana"):
+            try:
+                count = self.load(self._load_all(), "hana")
+                logger.info("Preloaded metadata for %d artists from HANA", count)
+                return count
+            except Exception as e:
+                if source == "hana":
+                    raise
+                logger.warning(f"HANA metadata preload failed, falling back to CSV: {str(e)}")
+        count = self.load(hana_utils.load_artists_csv(self.csv_path), "csv")
+        logger.info("Preloaded metadata for %d artists from %s", count, self.csv_path)
+        return count
+
+    def start_refresh(self, interval=METADATA_REFRESH_INTERVAL, source=METADATA_PRELOAD):
+        """
+        Preload now and then re-preload every interval seconds on a daemon thread.
+        """
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return self._refresh_thread
+
+        def _run():
+            while True:
+                try:
+                    self.preload(source)
+                except Exception as e:
+                    logger.error(f"Metadata refresh failed: {str(e)}", exc_info=True)
+                if self._stop_refresh.wait(interval):
+                    break
+
+        self._stop_refresh.clear()
+        self._refresh_thread = threading.Thread(target=_run, name="metadata-refresh", daemon=True)
+        self._refresh_thread.start()
+        return self._refresh_thread
+
+    def stop_refresh(self):
+        self._stop_refresh.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "source": self.source,
+            "last_refresh": self.last_refresh,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_metadata_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = MetadataCache()
+    return _cache
+
+
+def set_metadata_cache(cache):
+    """
+    Swap the process-wide cache, e.g. for one with max_size=0 in benchmarks.
+    """
+    global _cache
+    _cache = cache
+
+
+def get_artists_metadata(artist_ids) -> dict:
+    return get_metadata_cache().get_many(artist_ids)
+
+
+def get_artist_metadata(artist_id) -> dict:
+    return get_metadata_cache().get(artist_id)
@@ -0,0 +1,237 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dotenv import load_dotenv
+import bisect
+import logging
+import os
+import threading
+import time
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Config ---
+# Profile one request in every PROFILE_EVERY_N (0 disables the profiler)
+PROFILE_EVERY_N = int(os.getenv("PROFILE_EVERY_N", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles"))
+# "cprofile" or "pyinstrument" (if installed; sees through async and threads better)
+PROFILER = os.getenv("PROFILER", "cprofile")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), series["counts"]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    labels = _format_labels(self.labelnames + ("le",), key + (le,))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {series['sum']}")
+                lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+
+_registry = []
+
+
+def register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def render_prometheus():
+    """
+    Every registered metric in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = register(Histogram(
+    "trumuse_stage_seconds", "Time spent in each pipeline stage", ["pipeline", "stage"]
+))
+REQUEST_SECONDS = register(Histogram(
+    "trumuse_request_seconds", "HTTP request latency", ["method", "route", "status"]
+))
+STAGE_ERRORS = register(Counter(
+    "trumuse_stage_errors_total", "Pipeline stages that raised", ["pipeline", "stage"]
+))
+
+# Timings of the current request, read by the middleware for the Server-Timing header
+_request_timings = ContextVar("request_timings", default=None)
+
+
+def start_request_timings():
+    timings = []
+    _request_timings.set(timings)
+    return timings
+
+
+@contextmanager
+def span(stage, pipeline="attribution"):
+    """
+    Time a block: observed into trumuse_stage_seconds and added to the current
+    request's Server-Timing header.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(pipeline=pipeline, stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, pipeline=pipeline, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((f"{pipeline}-{stage}" if pipeline != "attribution" else stage, elapsed))
+
+
+def server_timing_header(timings):
+    return ", ".join(f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in timings)
+
+
+# Only one profiler can be active per process (Python 3.12+ refuses a second one)
+_profiling = threading.Lock()
+
+
+class SamplingProfiler:
+    """
+    Profiles one request in every `every` and writes the result under `directory`.
+    A sample that comes up while another request is being profiled is skipped.
+    """
+
+    def __init__(self, every=PROFILE_EVERY_N, directory=PROFILE_DIR, kind=PROFILER):
+        self.every = every
+        self.directory = directory
+        self.kind = kind
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def should_sample(self):
+        if self.every <= 0:
+            return False
+        with self._lock:
+            self._count += 1
+            return self._count % self.every == 0
+
+    def start(self):
+        """
+        A running profiler, or None if another request is already being profiled.
+        """
+        if not _profiling.acquire(blocking=False):
+            return None
+        try:
+            return self._start()
+        except Exception as e:
+            _profiling.release()
+            logger.warning(f"Failed to start profiler: {str(e)}")
+            return None
+
+    def _start(self):
+        if self.kind == "pyinstrument":
+            try:
+                from pyinstrument import Profiler
+                profiler = Profiler(async_mode="enabled")
+                profiler.start()
+                return profiler
+            except ImportError:
+                logger.warning("pyinstrument is not installed, falling back to cProfile")
+                self.kind = "cprofile"
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def stop(self, profiler, label):
+        try:
+            self._stop(profiler, label)
+        finally:
+            _profiling.release()
+
+    def _stop(self, profiler, label):
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{label.strip('/').replace('/', '_') or 'root'}"
+        try:
+            if self.kind == "pyinstrument":
+                profiler.stop()
+                path = os.path.join(self.directory, name + ".html")
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(profiler.output_html())
+            else:
+                profiler.disable()
+                path = os.path.join(self.directory, name + ".prof")
+                profiler.dump_stats(path)
+            logger.info("Wrote request profile to %s", path)
+        except Exception as e:
+            logger.warning(f"Failed to write profile: {str(e)}")
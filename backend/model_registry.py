@@ -0,0 +1,160 @@
+import threading
+import time
+import logging
+import os
+import torch
+import clip
+from dotenv import load_dotenv
+import clip_inference
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Config ---
+DEFAULT_MODEL = os.getenv("CLIP_MODEL_NAME", "ViT-B/32")
+# "background" loads at startup without blocking, "blocking" loads before serving,
+# "off" waits for the first request that needs the model.
+CLIP_WARMUP = os.getenv("CLIP_WARMUP", "background")
+
+_models = {}
+_load_stats = {}
+# Models that have also run one forward pass in this process
+_warm = set()
+_lock = threading.Lock()
+_key_locks = {}
+
+
+def default_device():
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def resident_memory_mb():
+    """
+    Current resident set size of this process in MB (0.0 if it can't be read).
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        # ru_maxrss is the peak, in KB on Linux; best we can do elsewhere
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except (ImportError, AttributeError):
+        return 0.0
+
+
+def shared_memory_mb():
+    """
+    Proportional (PSS) and shared resident memory of this process in MB, from
+    /proc/self/smaps_rollup. Shows how much of the weights pre-forked workers
+    share with each other. Empty dict where it can't be read.
+    """
+    fields = {"Pss": "pss_mb", "Shared_Clean": "shared_mb", "Shared_Dirty": "shared_mb"}
+    figures = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in fields:
+                    key = fields[name]
+                    figures[key] = figures.get(key, 0.0) + int(value.split()[0]) / 1024
+    except (OSError, ValueError):
+        return {}
+    return {key: round(mb, 1) for key, mb in figures.items()}
+
+
+def get_model(name=DEFAULT_MODEL, device=None):
+    """
+    Return (model, preprocess) for a CLIP model, loading it on first use.
+    Each (name, device) pair is loaded once per process and shared by all callers.
+    """
+    key = (name, device or default_device())
+    if key in _models:
+        return _models[key]
+
+    with _lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        if key not in _models:
+            rss_before = resident_memory_mb()
+            start = time.perf_counter()
+            model, preprocess = clip.load(key[0], device=key[1])
+            model.eval()
+            if key[1] == "cpu":
+                clip_inference.configure_threads()
+                clip_inference.optimize_for_cpu(model)
+            load_seconds = time.perf_counter() - start
+            rss_after = resident_memory_mb()
+            _load_stats[key] = {
+                "model": key[0],
+                "device": key[1],
+                "load_seconds": round(load_seconds, 3),
+                "rss_before_mb": round(rss_before, 1),
+                "rss_after_mb": round(rss_after, 1),
+                "inference": clip_inference.describe() if key[1] == "cpu" else None,
+            }
+            logger.info(
+                "Loaded CLIP %s on %s in %.2fs (RSS %.0f MB -> %.0f MB)",
+                key[0], key[1], load_seconds, rss_before, rss_after
+            )
+            _models[key] = (model, preprocess)
+    return _models[key]
+
+
+def is_loaded(name=DEFAULT_MODEL, device=None):
+    return (name, device or default_device()) in _models
+
+
+def is_warm(name=DEFAULT_MODEL, device=None):
+    return (name, device or default_device()) in _warm
+
+
+def _load_and_run(name, device):
+    key = (name, device or default_device())
+    model, _ = get_model(*key)
+    # One dummy forward pass, so lazy initialisation (thread pools, compiled
+    # kernels, allocator) happens before traffic rather than on the first request
+    size = getattr(model, "eager_visual", model.visual).input_resolution
+    start = time.perf_counter()
+    with torch.no_grad():
+        model.encode_image(torch.zeros(1, 3, size, size, device=key[1], dtype=model.dtype))
+    _warm.add(key)
+    logger.info("CLIP %s on %s warm after a %.2fs first forward pass", key[0], key[1], time.perf_counter() - start)
+
+
+def warm_up(name=DEFAULT_MODEL, device=None, background=True):
+    """
+    Load a model and run it once ahead of the first request. With background=True
+    this runs on a daemon thread and the thread is returned.
+    """
+    if not background:
+        _load_and_run(name, device)
+        return None
+
+    def _load():
+        try:
+            _load_and_run(name, device)
+        except Exception as e:
+            logger.error(f"Background CLIP warm-up failed: {str(e)}", exc_info=True)
+
+    thread = threading.Thread(target=_load, name="clip-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def stats():
+    """
+    Load time and memory figures for every model loaded in this process.
+    """
+    return {
+        "pid": os.getpid(),
+        "models": list(_load_stats.values()),
+        "warm": [{"model": name, "device": device} for name, device in sorted(_warm)],
+        "rss_mb": round(resident_memory_mb(), 1),
+        **shared_memory_mb(),
+    }
@@ -0,0 +1,100 @@
+from collections import OrderedDict
+from dotenv import load_dotenv
+import logging
+import os
+import threading
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Config ---
+PATCH_CACHE_MAX_MB = float(os.getenv("PATCH_CACHE_MAX_MB", "256"))
+PATCH_CACHE_SIZE = int(os.getenv("PATCH_CACHE_SIZE", "128"))
+
+
+class PatchGridCache:
+    """
+    Patch-embedding grids of original artworks, keyed by (content hash, engine).
+
+    Embedding every patch of the original is the expensive part of a heatmap, and
+    the same original is usually compared against several AI images in a row.
+    Bounded LRU on both entry count and total tensor bytes.
+    """
+
+    def __init__(self, max_bytes=int(PATCH_CACHE_MAX_MB * 1024 * 1024), max_items=PATCH_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _size(entry):
+        embeddings = entry[0]
+        return embeddings.element_size() * embeddings.nelement()
+
+    def get(self, key):
+        """
+        (embeddings, h, w) for the key, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, embeddings, h, w):
+        entry = (embeddings, h, w)
+        size = self._size(entry)
+        if size > self.max_bytes:
+            logger.warning("Patch grid of %d bytes is larger than the whole cache, not caching", size)
+            return entry
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= self._size(old)
+            self._entries[key] = entry
+            self.bytes += size
+            while len(self._entries) > self.max_items or self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= self._size(evicted)
+                self.evictions += 1
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_items": self.max_items,
+            "mb": round(self.bytes / (1024 * 1024), 2),
+            "max_mb": round(self.max_bytes / (1024 * 1024), 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_patch_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PatchGridCache()
+    return _cache
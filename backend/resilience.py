@@ -0,0 +1,285 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from dotenv import load_dotenv
+import logging
+import os
+import threading
+import time
+from metrics import Counter, Gauge, register
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Config ---
+# Total time an attribution request may spend on upstream calls
+REQUEST_BUDGET = float(os.getenv("REQUEST_BUDGET", "30"))
+# Consecutive failures that open a breaker, and how long it stays open before a trial call
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET = float(os.getenv("BREAKER_RESET", "30"))
+# Threads per upstream; calls beyond this many in flight (including abandoned,
+# timed-out ones) fail fast instead of queueing behind them
+RESILIENCE_WORKERS = int(os.getenv("RESILIENCE_WORKERS", "16"))
+
+_UNSET = object()
+
+BREAKER_STATE = register(Gauge(
+    "trumuse_breaker_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)", ["upstream"]
+))
+BREAKER_TRIPS = register(Counter(
+    "trumuse_breaker_trips_total", "Times a circuit breaker opened", ["upstream"]
+))
+FALLBACKS = register(Counter(
+    "trumuse_fallbacks_total", "Upstream calls that failed, timed out or were skipped, by reason", ["upstream", "reason"]
+))
+HEDGES = register(Counter(
+    "trumuse_hedged_requests_total", "Hedged second attempts, by which attempt answered", ["upstream", "winner"]
+))
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Saturated(CircuitOpen):
+    # Every thread for the upstream is busy; callers treat it like an open breaker
+    pass
+
+
+# --- Request budget ---
+
+_deadline = ContextVar("deadline", default=None)
+
+
+@contextmanager
+def request_budget(seconds=REQUEST_BUDGET):
+    """
+    Give every guarded call made inside the block (including from threads started
+    with the context copied, e.g. run_in_threadpool) a share of one overall deadline.
+    """
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining(timeout=None):
+    """
+    Seconds a call may take: its own timeout, capped by the request deadline if any.
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return timeout
+    left = deadline - time.monotonic()
+    return left if timeout is None else min(timeout, left)
+
+
+# --- Circuit breaker ---
+
+class CircuitBreaker:
+    """
+    Closed until `failures` consecutive calls fail, then open (calls fail fast) for
+    `reset_timeout` seconds, then half-open: one trial call closes it again or
+    re-opens it.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, name, failures=BREAKER_FAILURES, reset_timeout=BREAKER_RESET):
+        self.name = name
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+        BREAKER_STATE.set(self.state, upstream=name)
+
+    def _set_state(self, state):
+        self.state = state
+        BREAKER_STATE.set(state, upstream=self.name)
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self._trial_running:
+                    return False
+                self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._trial_running = False
+            if self.state != self.CLOSED:
+                logger.info("Circuit breaker %s closed", self.name)
+                self._set_state(self.CLOSED)
+
+    def record_skipped(self):
+        # The call ended without telling us anything about the upstream
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive += 1
+            self._trial_running = False
+            if self.state == self.HALF_OPEN or self._consecutive >= self.failures:
+                if self.state != self.OPEN:
+                    logger.warning("Circuit breaker %s opened after %d failures", self.name, self._consecutive)
+                    BREAKER_TRIPS.inc(upstream=self.name)
+                self._opened_at = time.monotonic()
+                self._set_state(self.OPEN)
+
+    def stats(self):
+        return {
+            "state": ("closed", "half_open", "open")[self.state],
+            "consecutive_failures": self._consecutive,
+        }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def stats():
+    with _breakers_lock:
+        return {name: breaker.stats() for name, breaker in _breakers.items()}
+
+
+# --- Guarded calls ---
+
+class Bulkhead:
+    """
+    A bounded thread pool for one upstream. Timed-out calls keep their thread until
+    the upstream answers, so a slow upstream can only exhaust its own pool, and
+    submit() refuses work instead of queueing once every thread is taken.
+    """
+
+    def __init__(self, name, workers=RESILIENCE_WORKERS):
+        self.workers = workers
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"upstream-{name}")
+
+    def _release(self, future):
+        with self._lock:
+            self.in_flight -= 1
+
+    def submit(self, fn, *args):
+        with self._lock:
+            if self.in_flight >= self.workers:
+                return None
+            self.in_flight += 1
+        future = self._executor.submit(copy_context().run, fn, *args)
+        future.add_done_callback(self._release)
+        return future
+
+
+_bulkheads = {}
+
+
+def get_bulkhead(name):
+    with _breakers_lock:
+        if name not in _bulkheads:
+            _bulkheads[name] = Bulkhead(name)
+        return _bulkheads[name]
+
+
+def _run(name, fn, args, timeout, hedge_after):
+    """
+    fn(*args) on the upstream's pool, abandoned after `timeout` seconds. With
+    hedge_after, a second identical attempt starts if the first hasn't answered by
+    then (and a thread is free), and the first successful answer wins.
+    """
+    bulkhead = get_bulkhead(name)
+    first = bulkhead.submit(fn, *args)
+    if first is None:
+        raise Saturated(f"All {bulkhead.workers} {name} threads are busy")
+    attempts = [first]
+    hedged = False
+    deadline = None if timeout is None else time.monotonic() + timeout
+    error = None
+    while True:
+        wait_for = None if deadline is None else max(0.0, deadline - time.monotonic())
+        if hedge_after and not hedged:
+            wait_for = hedge_after if wait_for is None else min(wait_for, hedge_after)
+        wait([a for a in attempts if not a.done()] or attempts, timeout=wait_for, return_when=FIRST_COMPLETED)
+        for attempt in attempts:
+            if attempt.done():
+                if attempt.exception() is None:
+                    if len(attempts) > 1:
+                        HEDGES.inc(upstream=name, winner="first" if attempt is attempts[0] else "hedge")
+                    return attempt.result()
+                error = error or attempt.exception()
+        if all(a.done() for a in attempts) and (hedged or not hedge_after):
+            raise error
+        if deadline is not None and time.monotonic() >= deadline:
+            raise DeadlineExceeded(f"{name} did not answer within {timeout:.2f}s")
+        if hedge_after and not hedged:
+            hedged = True
+            hedge = bulkhead.submit(fn, *args)
+            if hedge is not None:
+                attempts.append(hedge)
+
+
+def call(name, fn, *args, timeout=None, hedge_after=None, fallback=_UNSET):
+    """
+    Call an upstream through its circuit breaker, within `timeout` and the request
+    budget. hedge_after (seconds) enables a hedged second attempt, for idempotent
+    reads only. On failure, an open breaker or an exhausted budget, return
+    fallback() if one is given, otherwise raise (CircuitOpen, DeadlineExceeded or
+    the upstream's own exception). Calls cut short by the request budget or refused
+    because the upstream's threads are all busy don't count against its breaker.
+    """
+    budget = remaining(timeout)
+    if budget is not None and budget <= 0:
+        # The request ran out of time elsewhere; not the upstream's fault
+        FALLBACKS.inc(upstream=name, reason="budget")
+        if fallback is not _UNSET:
+            return fallback()
+        raise DeadlineExceeded(f"No time left in the request budget for {name}")
+    breaker = get_breaker(name)
+    if not breaker.allow():
+        FALLBACKS.inc(upstream=name, reason="circuit_open")
+        if fallback is not _UNSET:
+            return fallback()
+        raise CircuitOpen(f"{name} is unavailable")
+    try:
+        result = _run(name, fn, args, budget, hedge_after)
+    except Exception as e:
+        if isinstance(e, Saturated):
+            breaker.record_skipped()
+            reason = "saturated"
+        elif isinstance(e, DeadlineExceeded) and (timeout is None or budget < timeout):
+            # Cut short by the request budget, not the upstream's own timeout
+            breaker.record_skipped()
+            reason = "budget"
+        else:
+            breaker.record_failure()
+            reason = "timeout" if isinstance(e, DeadlineExceeded) else "error"
+        FALLBACKS.inc(upstream=name, reason=reason)
+        if fallback is _UNSET:
+            raise
+        logger.warning(f"{name} call failed ({reason}), using fallback: {str(e)}")
+        return fallback()
+    breaker.record_success()
+    return result
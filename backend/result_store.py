@@ -0,0 +1,206 @@
+from collections import OrderedDict
+from dotenv import load_dotenv
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Config ---
+RESULT_STORE_SIZE = int(os.getenv("RESULT_STORE_SIZE", "256"))
+RESULT_TTL = float(os.getenv("RESULT_TTL", "3600"))
+# Every result is also written here, so any worker can serve it and it survives
+# eviction from memory; empty keeps results in this process only
+RESULT_SPILL_DIR = os.getenv(
+    "RESULT_SPILL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+)
+
+# Seconds between sweeps of expired results by the purge thread
+RESULT_PURGE_INTERVAL = float(os.getenv("RESULT_PURGE_INTERVAL", "300"))
+
+_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+def new_result_id():
+    return uuid.uuid4().hex
+
+
+def is_valid_result_id(result_id):
+    return bool(_ID_PATTERN.match(result_id or ""))
+
+
+class ResultStore:
+    """
+    Per-request attribution results (frontend JSON + PDF), keyed by result id.
+
+    Recent results live in an in-memory LRU with a TTL. Every result is also
+    written through to the spill directory, which workers can share: a result put
+    by one worker (or pushed out of its memory) is read back from disk on demand.
+    """
+
+    def __init__(self, max_items=RESULT_STORE_SIZE, ttl=RESULT_TTL, spill_dir=RESULT_SPILL_DIR):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.spill_dir = spill_dir or None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._purge_thread = None
+        self._stop_purge = threading.Event()
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+    def _spill_paths(self, result_id):
+        return (os.path.join(self.spill_dir, f"{result_id}.json"),
+                os.path.join(self.spill_dir, f"{result_id}.pdf"))
+
+    def _spill(self, result_id, entry):
+        json_path, pdf_path = self._spill_paths(result_id)
+        try:
+            # PDF first and the JSON last, each renamed into place, so a reader in
+            # another worker never sees a partly written result
+            if entry["pdf"] is not None:
+                with open(pdf_path + ".tmp", "wb") as f:
+                    f.write(entry["pdf"])
+                os.replace(pdf_path + ".tmp", pdf_path)
+            with open(json_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"data": entry["data"], "expires_at": entry["expires_at"]}, f)
+            os.replace(json_path + ".tmp", json_path)
+        except OSError as e:
+            logger.warning(f"Failed to spill result {result_id}: {str(e)}")
+
+    def _read_spilled_json(self, result_id):
+        """
+        The stored {"data", "expires_at"} of a spilled result, or None if missing or
+        expired (removing it then).
+        """
+        json_path, _ = self._spill_paths(result_id)
+        try:
+            with open(json_path, encoding="utf-8") as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to read spilled result {result_id}: {str(e)}")
+            return None
+        if stored["expires_at"] < time.time():
+            self._remove_spilled(result_id)
+            return None
+        return stored
+
+    def _load_spilled(self, result_id):
+        stored = self._read_spilled_json(result_id)
+        if stored is None:
+            return None
+        _, pdf_path = self._spill_paths(result_id)
+        pdf = None
+        try:
+            with open(pdf_path, "rb") as f:
+                pdf = f.read()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Failed to read spilled result {result_id}: {str(e)}")
+            return None
+        return {"data": stored["data"], "pdf": pdf, "expires_at": stored["expires_at"]}
+
+    def _remove_spilled(self, result_id):
+        for path in self._spill_paths(result_id):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def put(self, data, pdf=None, result_id=None):
+        """
+        Store a result and return its id.
+        """
+        result_id = result_id or new_result_id()
+        entry = {"data": data, "pdf": pdf, "expires_at": time.time() + self.ttl}
+        if self.spill_dir:
+            self._spill(result_id, entry)
+        with self._lock:
+            self._entries[result_id] = entry
+            self._entries.move_to_end(result_id)
+            while len(self._entries) > self.max_items:
+                # Already on disk
+                self._entries.popitem(last=False)
+        return result_id
+
+    def get(self, result_id):
+        """
+        {"data", "pdf", "expires_at"} for a result, or None if unknown or expired.
+        """
+        if not is_valid_result_id(result_id):
+            return None
+        with self._lock:
+            entry = self._entries.get(result_id)
+            if entry is not None:
+                if entry["expires_at"] > time.time():
+                    self._entries.move_to_end(result_id)
+                    return entry
+                del self._entries[result_id]
+                if self.spill_dir:
+                    self._remove_spilled(result_id)
+                return None
+        if self.spill_dir:
+            return self._load_spilled(result_id)
+        return None
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            for result_id in [k for k, v in self._entries.items() if v["expires_at"] <= now]:
+                del self._entries[result_id]
+        if self.spill_dir:
+            for filename in os.listdir(self.spill_dir):
+                result_id, ext = os.path.splitext(filename)
+                if ext == ".json" and is_valid_result_id(result_id):
+                    # Only the small JSON: it holds expires_at and the PDF is left alone
+                    self._read_spilled_json(result_id)
+
+    def start_purge(self, interval=RESULT_PURGE_INTERVAL):
+        """
+        Purge expired results every interval seconds on a daemon thread.
+        """
+        if self._purge_thread is not None and self._purge_thread.is_alive():
+            return self._purge_thread
+
+        def _run():
+            while not self._stop_purge.wait(interval):
+                try:
+                    self.purge_expired()
+                except Exception as e:
+                    logger.error(f"Result purge failed: {str(e)}", exc_info=True)
+
+        self._stop_purge.clear()
+        self._purge_thread = threading.Thread(target=_run, name="result-purge", daemon=True)
+        self._purge_thread.start()
+        return self._purge_thread
+
+    def stop_purge(self):
+        self._stop_purge.set()
+
+    def stats(self):
+        spilled = 0
+        if self.spill_dir:
+            spilled = sum(1 for f in os.listdir(self.spill_dir) if f.endswith(".json"))
+        return {"in_memory": len(self._entries), "max_items": self.max_items, "spilled": spilled}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_result_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ResultStore()
+    return _store
@@ -0,0 +1,112 @@
+from dotenv import load_dotenv
+import logging
+import os
+import threading
+import numpy as np
+from vector_store import VECTOR_STORE, create_vector_store, get_vector_store
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Config ---
+# "flat": one query on the artist index. "two_stage": shortlist artists on the
+# centroid index, then re-rank them on their painting vectors.
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "flat")
+# Centroids fetched in the first stage
+RETRIEVAL_SHORTLIST = int(os.getenv("RETRIEVAL_SHORTLIST", "50"))
+# "max" (best painting) or "mean_top_n" (mean of the artist's top RETRIEVAL_TOP_N paintings)
+RETRIEVAL_AGGREGATE = os.getenv("RETRIEVAL_AGGREGATE", "mean_top_n")
+RETRIEVAL_TOP_N = int(os.getenv("RETRIEVAL_TOP_N", "3"))
+PAINTINGS_INDEX = os.getenv("PAINTINGS_INDEX")
+
+
+def aggregate_scores(artist_ids, scores, how=RETRIEVAL_AGGREGATE, top_n=RETRIEVAL_TOP_N):
+    """
+    One score per artist from per-painting scores: the best painting ("max") or the
+    mean of the artist's top_n paintings ("mean_top_n"). Returns (artists, scores).
+    """
+    artist_ids = np.asarray(artist_ids, dtype=np.int64)
+    scores = np.asarray(scores, dtype=np.float32)
+    if not len(scores):
+        return artist_ids, scores
+    # Group by artist, best painting first within each group
+    order = np.lexsort((-scores, artist_ids))
+    artist_ids, scores = artist_ids[order], scores[order]
+    starts = np.flatnonzero(np.r_[True, artist_ids[1:] != artist_ids[:-1]])
+    if how == "max":
+        return artist_ids[starts], scores[starts]
+    if how != "mean_top_n":
+        raise ValueError(f"Unknown RETRIEVAL_AGGREGATE: {how}")
+    counts = np.diff(np.append(starts, len(scores)))
+    group = np.repeat(np.arange(len(starts)), counts)
+    keep = np.arange(len(scores)) - starts[group] < top_n
+    sums = np.bincount(group[keep], weights=scores[keep], minlength=len(starts))
+    return artist_ids[starts], (sums / np.minimum(counts, top_n)).astype(np.float32)
+
+
+class TwoStageRetriever:
+    """
+    Artist search that stays cheap as the painting corpus grows.
+
+    Stage one queries the compact centroid index (one or a few vectors per artist)
+    for a shortlist of artists. Stage two scores only those artists' painting
+    vectors and aggregates them per artist, so each artist appears once. Shortlisted
+    artists with no paintings in the index are dropped, as centroid and painting
+    scores are not on the same scale; if none of them has paintings, the centroid
+    ranking is returned as is.
+    """
+
+    def __init__(self, centroid_store, painting_store, shortlist=RETRIEVAL_SHORTLIST,
+                 aggregate=RETRIEVAL_AGGREGATE, top_n=RETRIEVAL_TOP_N):
+        self.centroid_store = centroid_store
+        self.painting_store = painting_store
+        self.shortlist = shortlist
+        self.aggregate = aggregate
+        self.top_n = top_n
+
+    @staticmethod
+    def _candidates(matches):
+        # Multi-centroid indexes carry artist_id in metadata; single-centroid ids are artist ids
+        candidates = {}
+        for match in matches:
+            artist_id = int((match.metadata or {}).get("artist_id", match.id))
+            if artist_id not in candidates:
+                candidates[artist_id] = match.score
+        return candidates
+
+    def _rerank(self, vector, candidates, top_k):
+        labels, scores = self.painting_store.artist_scores(vector, list(candidates), per_artist=self.top_n)
+        artists, artist_scores = aggregate_scores(labels, scores, self.aggregate, self.top_n)
+        ranked = dict(zip(artists.tolist(), artist_scores.tolist())) or candidates
+        return sorted(ranked.items(), key=lambda kv: kv[1], reverse=True)[:top_k]
+
+    def search(self, vector, top_k=5):
+        """
+        Top-k (artist_id, score) pairs, one per artist.
+        """
+        matches = self.centroid_store.query(vector, top_k=max(self.shortlist, top_k), include_metadata=True)
+        return self._rerank(vector, self._candidates(matches), top_k)
+
+    def search_many(self, vectors, top_k=5):
+        shortlists = self.centroid_store.query_many(vectors, top_k=max(self.shortlist, top_k), include_metadata=True)
+        return [self._rerank(vector, self._candidates(matches), top_k)
+                for vector, matches in zip(vectors, shortlists)]
+
+
+_retriever = None
+_retriever_lock = threading.Lock()
+
+
+def get_retriever():
+    """
+    TwoStageRetriever over the configured artist index and PAINTINGS_INDEX.
+    """
+    global _retriever
+    if _retriever is None:
+        with _retriever_lock:
+            if _retriever is None:
+                if not PAINTINGS_INDEX:
+                    raise ValueError("RETRIEVAL_MODE=two_stage needs PAINTINGS_INDEX")
+                _retriever = TwoStageRetriever(get_vector_store(), create_vector_store(VECTOR_STORE, PAINTINGS_INDEX))
+    return _retriever
@@ -0,0 +1,278 @@
+"""
+Production launcher: load CLIP once, then fork the uvicorn workers.
+
+    python serve.py --workers 4 --host 0.0.0.0 --port 8000
+
+The parent process loads and freezes the CLIP weights (with the configured
+CLIP_QUANTIZE / CLIP_COMPILE mode), binds the listening socket and forks
+--workers children that serve main:app on it. The children inherit the weights
+copy-on-write (or in shared memory with PREFORK_SHARE=shm), so each extra worker
+costs its activations and Python heap rather than another copy of the model, and
+a replacement worker is serving within seconds instead of reloading torch and
+CLIP. Each worker still runs one warm-up forward pass; /readyz returns 503 until
+it has.
+
+The parent restarts workers that exit, restarts all of them (gracefully, one by
+one) on SIGHUP, and stops them on SIGTERM / SIGINT.
+
+Workers share no memory beyond the weights and requests are not routed to a
+particular worker. Attribution results are shared through RESULT_SPILL_DIR, but
+the /jobs endpoints keep jobs in the worker that accepted them (JOB_BACKEND=local
+is the only backend), so polling them can land on a worker that doesn't know the
+job. More than one worker is therefore refused unless --allow-local-jobs says the
+job endpoints are unused or a sticky load balancer sits in front.
+
+Forking after CUDA is initialised is not safe, so on a GPU host the parent skips
+the preload and every worker loads its own copy.
+"""
+from dotenv import load_dotenv
+import argparse
+import gc
+import importlib
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+load_dotenv()
+
+logger = logging.getLogger("serve")
+
+# --- Config ---
+# "cow": weights stay in the parent's pages, shared copy-on-write.
+# "shm": weights are moved to shared memory first, so they stay shared even if written.
+PREFORK_SHARE = os.getenv("PREFORK_SHARE", "cow")
+# Seconds a worker gets to finish in-flight requests on shutdown or restart
+WORKER_GRACEFUL_TIMEOUT = float(os.getenv("WORKER_GRACEFUL_TIMEOUT", "30"))
+# Third-party modules imported in the parent so workers share their pages too.
+# App modules are left to the workers: importing main starts background threads.
+PRELOAD_MODULES = ("numpy", "PIL.Image", "cv2", "torch", "torchvision", "clip")
+
+
+def preload_model(share=PREFORK_SHARE):
+    """
+    Load the default CLIP model in this process and freeze it for sharing with
+    forked workers. Returns False when the model is left to the workers (CUDA).
+    """
+    import clip_inference
+    import model_registry
+
+    if model_registry.default_device() != "cpu":
+        logger.info("Not preloading CLIP: device is %s, workers load their own", model_registry.default_device())
+        return False
+    # One intra-op thread and no inter-op setting here: neither pool may be running
+    # at fork time, and every worker sizes its own after the fork
+    clip_inference.configure_threads(num_threads=1, interop_threads=0)
+    model, _ = model_registry.get_model()
+    model.requires_grad_(False)
+    if share == "shm":
+        model.share_memory()
+    elif share != "cow":
+        raise ValueError(f"Unknown PREFORK_SHARE: {share}")
+    # Keep the garbage collector from writing to (and so un-sharing) everything
+    # allocated so far
+    gc.collect()
+    gc.freeze()
+    logger.info("Preloaded CLIP in the parent (%s), RSS %.0f MB", share, model_registry.resident_memory_mb())
+    return True
+
+
+def bind_socket(host, port, backlog=2048):
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(index, sock, args):
+    """
+    Body of a forked worker: serve main:app on the inherited socket until told to stop.
+    """
+    import uvicorn
+    import clip_inference
+    from log_config import configure_logging, stop_logging
+
+    for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(sig, signal.SIG_DFL)
+    filename = args.log_file
+    if filename and args.workers > 1:
+        # One rotating file per worker; rotation is not safe across processes
+        root, ext = os.path.splitext(filename)
+        filename = f"{root}.{index}{ext}"
+    configure_logging(filename=filename)
+    clip_inference.configure_threads()
+
+    config = uvicorn.Config(
+        "main:app", log_config=None, proxy_headers=True, forwarded_allow_ips=args.forwarded_allow_ips,
+        timeout_graceful_shutdown=WORKER_GRACEFUL_TIMEOUT, timeout_keep_alive=args.keep_alive
+    )
+    uvicorn.Server(config).run(sockets=[sock])
+    stop_logging()
+
+
+class Supervisor:
+    """
+    Forks and watches the worker processes.
+    """
+
+    def __init__(self, sock, args):
+        self.sock = sock
+        self.args = args
+        self.workers = {}  # pid -> (index, started_at)
+        self.failures = {}  # index -> consecutive quick exits
+        self.stopping = False
+        self.restart_queue = []
+        self.planned = set()  # pids stopped for a rolling restart
+
+    def spawn(self, index):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(index, self.sock, self.args)
+            except SystemExit as e:
+                # uvicorn exits with 3 when the app fails to start
+                code = e.code if isinstance(e.code, int) else int(e.code is not None)
+            except BaseException:
+                logging.getLogger("serve").exception("Worker %d crashed", index)
+                code = 1
+            finally:
+                os._exit(code)
+        self.workers[pid] = (index, time.monotonic())
+        logger.info("Started worker %d (pid %d)", index, pid)
+        return pid
+
+    def _on_stop(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.workers):
+            self._signal(pid, signal.SIGTERM)
+
+    def _on_hup(self, signum, frame):
+        # Restart workers one at a time so the rest keep serving
+        self.restart_queue = list(self.workers)
+
+    @staticmethod
+    def _signal(pid, sig):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def _reap(self):
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.workers.clear()
+                return
+            if pid == 0:
+                return
+            if pid not in self.workers:
+                continue
+            index, started = self.workers.pop(pid)
+            code = os.waitstatus_to_exitcode(status) if hasattr(os, "waitstatus_to_exitcode") else status
+            if self.stopping:
+                continue
+            if pid in self.planned:
+                self.planned.discard(pid)
+                self.spawn(index)
+                continue
+            lived = time.monotonic() - started
+            self.failures[index] = self.failures.get(index, 0) + 1 if lived < 10 else 0
+            delay = min(30.0, 0.5 * 2 ** self.failures[index]) if self.failures[index] else 0.0
+            logger.warning("Worker %d (pid %d) exited with %s after %.1fs, restarting in %.1fs",
+                           index, pid, code, lived, delay)
+            time.sleep(delay)
+            if not self.stopping:
+                self.spawn(index)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_hup)
+        for index in range(self.args.workers):
+            self.spawn(index)
+
+        restarting = None
+        while self.workers:
+            self._reap()
+            if self.stopping:
+                break
+            # Rolling restart: signal the next worker once the previous one is gone
+            if self.restart_queue and (restarting is None or restarting not in self.workers):
+                restarting = self.restart_queue.pop(0)
+                if restarting in self.workers:
+                    logger.info("Restarting worker pid %d", restarting)
+                    self.planned.add(restarting)
+                    self._signal(restarting, signal.SIGTERM)
+            time.sleep(0.2)
+
+        deadline = time.monotonic() + WORKER_GRACEFUL_TIMEOUT + 5
+        while self.workers and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.2)
+        for pid in list(self.workers):
+            logger.warning("Worker pid %d did not stop in time, killing it", pid)
+            self._signal(pid, signal.SIGKILL)
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        self.workers.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with CLIP preloaded and shared by forked workers")
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")),
+                        help="More than 1 needs RESULT_SPILL_DIR set, and --allow-local-jobs: /jobs "
+                             "state is per worker, so job polling only works behind sticky routing")
+    parser.add_argument("--allow-local-jobs", action="store_true",
+                        help="Run several workers even though /jobs/{id} only answers on the worker that took the job")
+    parser.add_argument("--keep-alive", type=int, default=5, help="Keep-alive timeout in seconds")
+    parser.add_argument("--forwarded-allow-ips", default=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"))
+    parser.add_argument("--log-file", default=os.getenv("LOG_FILE", "backend.log"),
+                        help="Per-worker log files are suffixed with the worker number")
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.workers > 1:
+        from job_queue import JOB_BACKEND
+        from result_store import RESULT_SPILL_DIR
+        if not RESULT_SPILL_DIR:
+            parser.error("--workers > 1 needs RESULT_SPILL_DIR: results are shared between workers through it")
+        if JOB_BACKEND == "local" and not args.allow_local_jobs:
+            parser.error("--workers > 1 with JOB_BACKEND=local breaks /jobs polling across workers; "
+                         "pass --allow-local-jobs if the job endpoints are unused or routing is sticky")
+
+    # Read by clip_inference to split the cores between workers
+    os.environ["WEB_CONCURRENCY"] = str(args.workers)
+    # Workers find the model already loaded; they only run the warm-up pass
+    os.environ["CLIP_WARMUP"] = "blocking"
+    # main mounts ../frontend relative to the working directory
+    os.chdir(BASE_DIR)
+    sys.path.insert(0, BASE_DIR)
+
+    # Plain stderr logging in the parent: the queued logger's writer thread would
+    # not survive the fork
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - serve - %(levelname)s - %(message)s")
+    for name in PRELOAD_MODULES:
+        importlib.import_module(name)
+    preload_model()
+
+    sock = bind_socket(args.host, args.port)
+    logger.info("Listening on %s:%d with %d workers", args.host, args.port, args.workers)
+    Supervisor(sock, args).run()
+    sock.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+from dotenv import load_dotenv
+import concurrent.futures
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Config ---
+SUMMARY_CACHE_PATH = os.getenv(
+    "SUMMARY_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "summary_cache.sqlite3")
+)
+# Default: 30 days. Bios change rarely; a new prompt or model gets new keys anyway.
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL", str(30 * 24 * 3600)))
+
+
+def summary_key(url, prompt, model):
+    """
+    Content address of a summary: the same URL, prompt and model always map to the same key.
+    """
+    return hashlib.sha256("\x1f".join((model, url, prompt)).encode("utf-8")).hexdigest()
+
+
+class SummaryCache:
+    """
+    Persistent SQLite cache of artist bio summaries with TTL and single-flight misses.
+
+    get_or_compute() makes concurrent callers that miss on the same key share one
+    upstream call instead of each making their own.
+    """
+
+    def __init__(self, path=SUMMARY_CACHE_PATH, ttl=SUMMARY_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            "key TEXT PRIMARY KEY, url TEXT, model TEXT, summary TEXT, created_at REAL)"
+        )
+        self._conn.commit()
+        self._db_lock = threading.Lock()
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        try:
+            purged = self.purge_expired()
+            if purged:
+                logger.info("Purged %d expired summaries from %s", purged, path)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to purge expired summaries: {str(e)}")
+
+    def get(self, key):
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT summary, created_at FROM summaries WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or time.time() - row[1] > self.ttl:
+            return None
+        return row[0]
+
+    def put(self, key, summary, url=None, model=None):
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries (key, url, model, summary, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, url, model, summary, time.time())
+            )
+            self._conn.commit()
+
+    def get_or_compute(self, key, compute, url=None, model=None):
+        """
+        Cached summary for key, or compute() it once no matter how many callers miss
+        at the same time. Exceptions from compute() are raised to every waiter and
+        nothing is cached. SQLite errors (e.g. "database is locked" with several
+        writers) are logged and treated as a miss or a skipped write, so a computed
+        summary is still returned.
+        """
+        summary = self._get_or_none(key)
+        if summary is not None:
+            self.hits += 1
+            return summary
+
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self._inflight[key] = future
+
+        if not owner:
+            self.shared += 1
+            return future.result()
+
+        try:
+            # An owner that finished between our first lookup and taking ownership
+            # has already stored the summary
+            summary = self._get_or_none(key)
+            if summary is not None:
+                self.hits += 1
+                future.set_result(summary)
+                return summary
+            self.misses += 1
+            summary = compute()
+            try:
+                self.put(key, summary, url, model)
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to cache summary for {url or key}: {str(e)}")
+            future.set_result(summary)
+            return summary
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+    def _get_or_none(self, key):
+        try:
+            return self.get(key)
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to read cached summary {key}: {str(e)}")
+            return None
+
+    def purge_expired(self):
+        with self._db_lock:
+            cursor = self._conn.execute(
+                "DELETE FROM summaries WHERE created_at < ?", (time.time() - self.ttl,)
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+    def stats(self):
+        with self._db_lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM summaries").fetchone()[0]
+        return {
+            "size": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared_inflight": self.shared,
+            "path": self.path,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_summary_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SummaryCache()
+    return _cache
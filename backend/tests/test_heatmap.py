@@ -0,0 +1,34 @@
+"""
+Regression test: the batched "crops" heatmap engine must match the per-patch
+reference maps. Skipped where torch / CLIP aren't installed.
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("clip")
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import heatmap_generator  # noqa: E402
+
+
+def synthetic_image(seed, size=128):
+    # Blocky colour noise with a gradient, so patches differ from each other
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(0, 256, (size // 16, size // 16, 3), dtype=np.uint8)
+    pixels = np.kron(blocks, np.ones((16, 16, 1), dtype=np.uint8)).astype(np.float32)
+    pixels += np.linspace(0, 60, size, dtype=np.float32)[None, :, None]
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+@pytest.mark.parametrize("seeds", [(0, 1), (2, 2)])
+def test_crops_engine_matches_per_patch_reference(seeds):
+    original, ai = (synthetic_image(seed) for seed in seeds)
+    result = heatmap_generator.compare_with_reference(original, ai, engine="crops")
+    min_correlation, max_abs_diff = heatmap_generator.REFERENCE_LIMITS["crops"]
+    assert result["correlation"] >= min_correlation
+    assert result["max_abs_diff"] <= max_abs_diff
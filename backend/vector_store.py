@@ -0,0 +1,467 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import json
+import logging
+import os
+import threading
+import numpy as np
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# --- Config ---
+# "pinecone" or "local"
+VECTOR_STORE = os.getenv("VECTOR_STORE", "pinecone")
+PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "trumuse-dev2")
+LOCAL_INDEX_PATH = os.getenv(
+    "LOCAL_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "vector_index")
+)
+LOCAL_INDEX_DTYPE = os.getenv("LOCAL_INDEX_DTYPE", "float32")
+# "exact", "ivf" (inverted lists) or "ivfpq" (inverted lists + product quantisation)
+LOCAL_INDEX_MODE = os.getenv("LOCAL_INDEX_MODE", "exact")
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+PQ_M = int(os.getenv("PQ_M", "32"))
+PQ_RERANK = int(os.getenv("PQ_RERANK", "50"))
+# Deadline for one artist query, and when to send a hedged second query (0 = never)
+VECTOR_TIMEOUT = float(os.getenv("VECTOR_TIMEOUT", "5"))
+VECTOR_HEDGE_AFTER = float(os.getenv("VECTOR_HEDGE_AFTER", "0"))
+# Concurrent requests a remote store (Pinecone) sends for a batch of queries
+VECTOR_QUERY_WORKERS = int(os.getenv("VECTOR_QUERY_WORKERS", "16"))
+
+Match = namedtuple("Match", ["id", "score", "metadata"])
+
+
+class VectorStore:
+    """
+    Interface shared by the vector backends. Vectors are CLIP embeddings, ids are strings.
+    """
+
+    def query(self, vector, top_k=5, include_metadata=False):
+        """
+        Top-k matches for one vector as a list of Match(id, score, metadata).
+        """
+        raise NotImplementedError
+
+    def query_many(self, vectors, top_k=5, include_metadata=False):
+        return [self.query(v, top_k, include_metadata) for v in vectors]
+
+    def artist_scores(self, vector, artist_ids, per_artist=None):
+        """
+        Scores of the vectors whose metadata artist_id is one of artist_ids, as two
+        arrays: the artist id of each vector and its score. Used to re-rank a
+        shortlist of artists on a painting-level index. Stores that can't return
+        every vector return at least the best per_artist of each artist.
+        """
+        raise NotImplementedError
+
+    def upsert(self, ids, vectors, metadata=None):
+        raise NotImplementedError
+
+    def delete(self, ids):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def count(self):
+        raise NotImplementedError
+
+
+class PineconeVectorStore(VectorStore):
+    def __init__(self, index_name=PINECONE_INDEX_NAME, api_key=None):
+        from pinecone import Pinecone
+        self.pc = Pinecone(api_key=api_key or os.getenv("PINECONE_API_KEY"))
+        self.index = self.pc.Index(index_name)
+
+    def query(self, vector, top_k=5, include_metadata=False):
+        response = self.index.query(vector=np.asarray(vector).tolist(), top_k=top_k, include_metadata=include_metadata)
+        return [Match(m["id"], m["score"], m["metadata"] if include_metadata else None)
+                for m in response["matches"]]
+
+    def query_many(self, vectors, top_k=5, include_metadata=False):
+        # Pinecone takes one vector per query, so send the batch concurrently
+        vectors = list(vectors)
+        if len(vectors) <= 1:
+            return [self.query(v, top_k, include_metadata) for v in vectors]
+        with ThreadPoolExecutor(max_workers=min(VECTOR_QUERY_WORKERS, len(vectors))) as executor:
+            return list(executor.map(lambda v: self.query(v, top_k, include_metadata), vectors))
+
+    def artist_scores(self, vector, artist_ids, per_artist=None):
+        # One filtered query per artist, so a shared top_k can't starve the
+        # lower-ranked artists of painting scores
+        vector = np.asarray(vector).tolist()
+
+        def best(artist_id):
+            response = self.index.query(vector=vector, top_k=per_artist or 10,
+                                        filter={"artist_id": int(artist_id)})
+            return [(int(artist_id), m["score"]) for m in response["matches"]]
+
+        artist_ids = list(artist_ids)
+        with ThreadPoolExecutor(max_workers=min(VECTOR_QUERY_WORKERS, max(1, len(artist_ids)))) as executor:
+            pairs = [pair for matches in executor.map(best, artist_ids) for pair in matches]
+        return (np.array([a for a, _ in pairs], dtype=np.int64),
+                np.array([score for _, score in pairs], dtype=np.float32))
+
+    def upsert(self, ids, vectors, metadata=None):
+        metadata = metadata or [None] * len(ids)
+        items = []
+        for id_, vector, meta in zip(ids, vectors, metadata):
+            item = {"id": str(id_), "values": np.asarray(vector, dtype=np.float32).tolist()}
+            if meta:
+                item["metadata"] = meta
+            items.append(item)
+        self.index.upsert(vectors=items)
+
+    def delete(self, ids):
+        if ids:
+            self.index.delete(ids=[str(i) for i in ids])
+
+    def count(self):
+        return self.index.describe_index_stats()["total_vector_count"]
+
+
+def _kmeans(x, k, iters=20, seed=0):
+    """
+    Plain Lloyd's k-means on the rows of x. Returns (centroids, assignments).
+    """
+    rng = np.random.default_rng(seed)
+    x = np.asarray(x, dtype=np.float32)
+    k = min(k, len(x))
+    centroids = x[rng.choice(len(x), size=k, replace=False)].copy()
+    x_sq = (x ** 2).sum(axis=1, keepdims=True)
+    for _ in range(iters):
+        dists = x_sq - 2 * x @ centroids.T + (centroids ** 2).sum(axis=1)
+        assignments = dists.argmin(axis=1)
+        for c in range(k):
+            members = x[assignments == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+            else:
+                centroids[c] = x[rng.integers(len(x))]
+    dists = x_sq - 2 * x @ centroids.T + (centroids ** 2).sum(axis=1)
+    return centroids, dists.argmin(axis=1)
+
+
+def _top_k(scores, k):
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx])]
+
+
+class LocalVectorStore(VectorStore):
+    """
+    In-process vector index backed by a memory-mapped float32/float16 matrix.
+
+    Files under path: vectors.npy (N x D, unit-normalised rows), ids.npy,
+    metadata.json (optional) and ivf.npz (optional coarse quantiser / PQ codes).
+    mode="exact" scores every row with one matrix product; "ivf" only scores the
+    rows in the nprobe closest inverted lists; "ivfpq" scores those lists with
+    product-quantised codes and re-ranks the best pq_rerank candidates exactly.
+    """
+
+    def __init__(self, path=LOCAL_INDEX_PATH, dtype=LOCAL_INDEX_DTYPE, mode=LOCAL_INDEX_MODE,
+                 nprobe=IVF_NPROBE, pq_rerank=PQ_RERANK):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.mode = mode
+        self.nprobe = nprobe
+        self.pq_rerank = pq_rerank
+        self._lock = threading.RLock()
+        self._dirty = False
+        # Upserts since the last _materialize(): appended rows, and replacements by row
+        self._pending_ids = []
+        self._pending_vectors = []
+        self._updates = {}
+        self._ivf = None
+        self._groups = None
+        self._load()
+
+    # --- Storage ---
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _load(self):
+        if os.path.exists(self._file("vectors.npy")):
+            self.vectors = np.load(self._file("vectors.npy"), mmap_mode="r")
+            self.ids = np.load(self._file("ids.npy"), allow_pickle=False).astype(str)
+            if self.vectors.dtype != self.dtype:
+                # New rows take the on-disk dtype; mixing would upcast the whole matrix
+                logger.warning("Index in %s is %s, ignoring LOCAL_INDEX_DTYPE=%s; rebuild it to change",
+                               self.path, self.vectors.dtype, self.dtype)
+                self.dtype = self.vectors.dtype
+        else:
+            self.vectors = np.empty((0, 0), dtype=self.dtype)
+            self.ids = np.empty(0, dtype=str)
+        self.metadata = {}
+        if os.path.exists(self._file("metadata.json")):
+            with open(self._file("metadata.json"), encoding="utf-8") as f:
+                self.metadata = json.load(f)
+        self._row_of = {id_: row for row, id_ in enumerate(self.ids)}
+        if self.mode != "exact" and len(self.ids):
+            if os.path.exists(self._file("ivf.npz")):
+                self._ivf = dict(np.load(self._file("ivf.npz")))
+                if int(self._ivf.get("n", -1)) != len(self.ids):
+                    # Written for a different vectors.npy; rows added since would never be probed
+                    logger.warning("Stale ivf.npz in %s (%s rows, index has %d)", self.path,
+                                   int(self._ivf.get("n", -1)), len(self.ids))
+                    self._ivf = None
+            if self._ivf is None or (self.mode == "ivfpq" and "codes" not in self._ivf):
+                logger.warning("No %s data in %s, building it now", self.mode, self.path)
+                self.build_ivf(pq_m=PQ_M if self.mode == "ivfpq" else 0)
+
+    def flush(self):
+        """
+        Write pending upserts to disk and re-open the matrix memory-mapped.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            self._materialize()
+            os.makedirs(self.path, exist_ok=True)
+            for name, array in (("vectors.npy", self.vectors), ("ids.npy", self.ids)):
+                tmp = self._file(name + ".tmp")
+                with open(tmp, "wb") as f:
+                    np.save(f, array)
+                os.replace(tmp, self._file(name))
+            with open(self._file("metadata.json.tmp"), "w", encoding="utf-8") as f:
+                json.dump(self.metadata, f)
+            os.replace(self._file("metadata.json.tmp"), self._file("metadata.json"))
+            self._dirty = False
+            self.vectors = np.load(self._file("vectors.npy"), mmap_mode="r")
+            if self.mode != "exact":
+                self.build_ivf(pq_m=PQ_M if self.mode == "ivfpq" else 0)
+            elif os.path.exists(self._file("ivf.npz")):
+                # No longer matches the vectors; rebuilt when next opened in ivf mode
+                os.remove(self._file("ivf.npz"))
+
+    def upsert(self, ids, vectors, metadata=None):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors.astype(self.dtype)
+        ids = [str(x) for x in ids]
+        # An id given more than once keeps its last vector
+        last = {id_: i for i, id_ in enumerate(ids)}
+        with self._lock:
+            # Buffered until the next query or flush, so a run of upserts copies the
+            # matrix once rather than once per call
+            for id_, i in last.items():
+                row = self._row_of.get(id_)
+                if row is None:
+                    self._row_of[id_] = len(self.ids) + len(self._pending_ids)
+                    self._pending_ids.append(id_)
+                    self._pending_vectors.append(vectors[i])
+                elif row >= len(self.ids):
+                    self._pending_vectors[row - len(self.ids)] = vectors[i]
+                else:
+                    self._updates[row] = vectors[i]
+                if metadata is not None and metadata[i] is not None:
+                    self.metadata[id_] = metadata[i]
+            self._ivf = None
+            self._dirty = True
+
+    def delete(self, ids):
+        with self._lock:
+            self._materialize()
+            rows = [self._row_of[str(i)] for i in ids if str(i) in self._row_of]
+            if not rows:
+                return
+            keep = np.ones(len(self.ids), dtype=bool)
+            keep[rows] = False
+            for i in ids:
+                self.metadata.pop(str(i), None)
+            self.vectors = np.asarray(self.vectors)[keep]
+            self.ids = self.ids[keep]
+            self._row_of = {id_: row for row, id_ in enumerate(self.ids)}
+            self._ivf = None
+            self._dirty = True
+
+    def _materialize(self):
+        # Apply buffered upserts; callers hold the lock
+        if not self._pending_ids and not self._updates:
+            return
+        dim = len(self._pending_vectors[0]) if self._pending_vectors else self.vectors.shape[1]
+        current = np.array(self.vectors) if len(self.ids) else np.empty((0, dim), dtype=self.dtype)
+        for row, vector in self._updates.items():
+            current[row] = vector
+        if self._pending_ids:
+            current = np.concatenate([current, np.stack(self._pending_vectors)])
+            self.ids = np.concatenate([self.ids, np.array(self._pending_ids, dtype=str)])
+        self.vectors = current
+        self._pending_ids, self._pending_vectors, self._updates = [], [], {}
+
+    def count(self):
+        with self._lock:
+            return len(self.ids) + len(self._pending_ids)
+
+    # --- IVF / PQ ---
+
+    def build_ivf(self, nlist=IVF_NLIST, pq_m=0, train_size=50000, seed=0):
+        """
+        Train the coarse quantiser (and PQ codebooks if pq_m > 0) and save ivf.npz.
+        """
+        with self._lock:
+            self._materialize()
+            n, dim = self.vectors.shape
+            if n == 0:
+                return
+            nlist = nlist or max(1, int(np.sqrt(n)))
+            rng = np.random.default_rng(seed)
+            sample_rows = np.sort(rng.choice(n, size=min(n, train_size), replace=False))
+            sample = np.asarray(self.vectors[sample_rows], dtype=np.float32)
+            centroids, _ = _kmeans(sample, nlist, seed=seed)
+            ivf = {"centroids": centroids.astype(np.float32), "n": np.int64(n)}
+
+            assignments = np.empty(n, dtype=np.int32)
+            for start in range(0, n, 65536):
+                chunk = np.asarray(self.vectors[start:start + 65536], dtype=np.float32)
+                assignments[start:start + len(chunk)] = (chunk @ centroids.T).argmax(axis=1)
+            ivf["order"] = np.argsort(assignments, kind="stable").astype(np.int64)
+            ivf["offsets"] = np.searchsorted(assignments[ivf["order"]], np.arange(len(centroids) + 1)).astype(np.int64)
+
+            if pq_m:
+                if dim % pq_m:
+                    raise ValueError(f"PQ_M={pq_m} must divide the vector dimension {dim}")
+                sub = dim // pq_m
+                codebooks = np.empty((pq_m, 256, sub), dtype=np.float32)
+                codes = np.empty((n, pq_m), dtype=np.uint8)
+                for j in range(pq_m):
+                    book, _ = _kmeans(sample[:, j * sub:(j + 1) * sub], 256, iters=10, seed=seed + j)
+                    codebooks[j, :len(book)] = book
+                    codebooks[j, len(book):] = book[0]
+                for start in range(0, n, 65536):
+                    chunk = np.asarray(self.vectors[start:start + 65536], dtype=np.float32)
+                    for j in range(pq_m):
+                        part = chunk[:, j * sub:(j + 1) * sub]
+                        dists = (part ** 2).sum(1, keepdims=True) - 2 * part @ codebooks[j].T + (codebooks[j] ** 2).sum(1)
+                        codes[start:start + len(chunk), j] = dists.argmin(axis=1)
+                ivf["codebooks"] = codebooks
+                ivf["codes"] = codes
+
+            self._ivf = ivf
+            os.makedirs(self.path, exist_ok=True)
+            np.savez(self._file("ivf.npz"), **ivf)
+
+    def _candidate_rows(self, ivf, query):
+        probe = _top_k(ivf["centroids"] @ query, self.nprobe)
+        return np.concatenate([ivf["order"][ivf["offsets"][c]:ivf["offsets"][c + 1]] for c in probe])
+
+    # --- Queries ---
+
+    def _snapshot(self):
+        # Upserts swap these references rather than mutating them, so queries can run unlocked
+        with self._lock:
+            self._materialize()
+            return self.vectors, self.ids, self._ivf
+
+    def _to_matches(self, ids, rows, scores, include_metadata):
+        return [Match(str(ids[r]), float(s), self.metadata.get(ids[r]) if include_metadata else None)
+                for r, s in zip(rows, scores)]
+
+    def query(self, vector, top_k=5, include_metadata=False):
+        query = np.asarray(vector, dtype=np.float32).ravel()
+        query = query / np.linalg.norm(query)
+        vectors, ids, ivf = self._snapshot()
+        if not len(ids):
+            return []
+        if self.mode == "exact" or ivf is None:
+            scores = np.asarray(vectors @ query.astype(vectors.dtype), dtype=np.float32)
+            rows = _top_k(scores, top_k)
+            return self._to_matches(ids, rows, scores[rows], include_metadata)
+
+        candidates = self._candidate_rows(ivf, query)
+        if "codes" in ivf:
+            codebooks = ivf["codebooks"]
+            pq_m, _, sub = codebooks.shape
+            tables = np.einsum("mcs,ms->mc", codebooks, query.reshape(pq_m, sub))
+            approx = tables[np.arange(pq_m), ivf["codes"][candidates]].sum(axis=1)
+            candidates = candidates[_top_k(approx, max(top_k, self.pq_rerank))]
+        candidates = np.sort(candidates)
+        scores = np.asarray(vectors[candidates], dtype=np.float32) @ query
+        best = _top_k(scores, top_k)
+        return self._to_matches(ids, candidates[best], scores[best], include_metadata)
+
+    def _artist_rows(self, ids):
+        """
+        Row order grouping the vectors by metadata artist_id, and {artist_id: (start, end)}
+        into it. Rebuilt whenever an upsert has replaced the ids array.
+        """
+        groups = self._groups
+        if groups is None or groups[0] is not ids:
+            artist_of = np.array([int((self.metadata.get(str(i)) or {}).get("artist_id", -1)) for i in ids],
+                                 dtype=np.int64)
+            order = np.argsort(artist_of, kind="stable")
+            artists, starts = np.unique(artist_of[order], return_index=True)
+            ends = np.append(starts[1:], len(order))
+            groups = (ids, order, {int(a): (int(s), int(e)) for a, s, e in zip(artists, starts, ends)})
+            self._groups = groups
+        return groups[1], groups[2]
+
+    def artist_scores(self, vector, artist_ids, per_artist=None):
+        query = np.asarray(vector, dtype=np.float32).ravel()
+        query = query / np.linalg.norm(query)
+        vectors, ids, _ = self._snapshot()
+        order, bounds = self._artist_rows(ids)
+        rows, labels = [], []
+        for artist_id in artist_ids:
+            start, end = bounds.get(int(artist_id), (0, 0))
+            if end > start:
+                rows.append(order[start:end])
+                labels.append(np.full(end - start, int(artist_id), dtype=np.int64))
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows, labels = np.concatenate(rows), np.concatenate(labels)
+        # Read the memory-mapped rows in file order
+        by_row = np.argsort(rows)
+        rows, labels = rows[by_row], labels[by_row]
+        return labels, np.asarray(vectors[rows], dtype=np.float32) @ query
+
+    def query_many(self, vectors, top_k=5, include_metadata=False):
+        queries = np.asarray(vectors, dtype=np.float32)
+        queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+        matrix, ids, ivf = self._snapshot()
+        if self.mode != "exact" and ivf is not None:
+            return [self.query(q, top_k, include_metadata) for q in queries]
+        if not len(ids):
+            return [[] for _ in queries]
+        scores = np.asarray(matrix @ queries.T.astype(matrix.dtype), dtype=np.float32).T
+        results = []
+        for row_scores in scores:
+            rows = _top_k(row_scores, top_k)
+            results.append(self._to_matches(ids, rows, row_scores[rows], include_metadata))
+        return results
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def create_vector_store(kind=VECTOR_STORE, name=None):
+    """
+    New store of the given kind. name is the index directory for "local" and the
+    index name for "pinecone"; both default to the configured index.
+    """
+    if kind == "local":
+        return LocalVectorStore(path=name or LOCAL_INDEX_PATH)
+    if kind == "pinecone":
+        return PineconeVectorStore(index_name=name or PINECONE_INDEX_NAME)
+    raise ValueError(f"Unknown VECTOR_STORE: {kind}")
+
+
+def get_vector_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_vector_store()
+    return _store
+
+
+def set_vector_store(store):
+    global _store
+    _store = store
@@ -1,17 +1,15 @@
-from pinecone import Pinecone, ServerlessSpec
+import math
 import numpy as np
 import torch
-from hana_utils import get_artist_metadata
+from metadata_cache import get_artists_metadata
+from vector_store import VECTOR_HEDGE_AFTER, VECTOR_QUERY_WORKERS, VECTOR_TIMEOUT, get_vector_store
+from retrieval import RETRIEVAL_MODE, get_retriever
 from dotenv import load_dotenv
-import os
+import resilience
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Pinecone
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
-index = pc.Index("trumuse-dev2")
-
 # --- Vector Similarity Utilities ---
 
 def get_clip_embedding(embedding_model, image):
@@ -25,28 +23,61 @@ def get_clip_embedding(embedding_model, image):
 
 def query_similar_vectors(query_vector, top_k=5):
     """
-    Query Pinecone index to find top_k most similar vectors.
+    Query the vector store to find top_k most similar vectors.
     Returns a list of (artist_id, similarity_score) tuples.
+    Raises resilience.CircuitOpen / DeadlineExceeded when the store is unavailable.
     """
-    query_response = index.query(vector=query_vector.tolist(), top_k=top_k, include_metadata=True)
+    return resilience.call(
+        "vector_store", _query_similar_vectors, query_vector, top_k,
+        timeout=VECTOR_TIMEOUT, hedge_after=VECTOR_HEDGE_AFTER or None
+    )
 
+def _query_similar_vectors(query_vector, top_k):
+    if RETRIEVAL_MODE == "two_stage":
+        return get_retriever().search(query_vector, top_k=top_k)
     results = []
-    for match in query_response["matches"]:
-        artist_id = int(match["id"])  # Convert ID to integer
-        score = match["score"]
-        results.append((artist_id, score))
+    for match in get_vector_store().query(query_vector, top_k=top_k):
+        artist_id = int(match.id)  # Convert ID to integer
+        results.append((artist_id, match.score))
     return results
 
+def query_similar_vectors_many(query_vectors, top_k=5):
+    """
+    Batched query_similar_vectors: one list of (artist_id, score) tuples per vector.
+    The deadline grows with the batch, so a full chunk isn't held to the time of
+    a single query.
+    """
+    # A remote store answers VECTOR_QUERY_WORKERS queries at a time; two-stage
+    # retrieval re-ranks the vectors one after another
+    if RETRIEVAL_MODE == "two_stage":
+        rounds = len(query_vectors)
+    else:
+        rounds = math.ceil(len(query_vectors) / VECTOR_QUERY_WORKERS)
+    rounds = max(1, rounds)
+    return resilience.call(
+        "vector_store", _query_similar_vectors_many, query_vectors, top_k,
+        timeout=VECTOR_TIMEOUT * rounds, hedge_after=VECTOR_HEDGE_AFTER * rounds or None
+    )
+
+def _query_similar_vectors_many(query_vectors, top_k):
+    if RETRIEVAL_MODE == "two_stage":
+        return get_retriever().search_many(query_vectors, top_k=top_k)
+    return [
+        [(int(match.id), match.score) for match in matches]
+        for matches in get_vector_store().query_many(query_vectors, top_k=top_k)
+    ]
+
 def get_similar_artists_info(query_vector, top_k=3):
     """
     Combines similarity query and metadata fetch. 
     Returns artist info + similarity scores.
     """
     similar_vectors = query_similar_vectors(query_vector, top_k=top_k)
+    metadata_by_id = get_artists_metadata([artist_id for artist_id, _ in similar_vectors])
     artist_infos = []
 
     for artist_id, score in similar_vectors:
-        metadata = get_artist_metadata(artist_id)
+        metadata = metadata_by_id.get(artist_id)
         if metadata:
             artist_infos.append({
                 "artist_id": artist_id,
@@ -56,11 +87,12 @@ def get_similar_artists_info(query_vector, top_k=3):
     return artist_infos
 
 from PIL import Image
-import clip
+import model_registry
 
-# Load CLIP
-device = "cuda" if torch.cuda.is_available() else "cpu"
-clip_model, preprocess = clip.load("ViT-B/32", device=device)
+def get_clip_model():
+    """
+    Shared (model, preprocess) pair from the model registry, loaded on first use.
+    """
+    return model_registry.get_model()
 
-# So main.py can import the model directly
-_all_ = ['get_clip_embedding', 'query_similar_vectors', 'clip_model', 'preprocess']
\ No newline at end of file
+_all_ = ['get_clip_embedding', 'query_similar_vectors', 'get_clip_model']
\ No newline at end of file